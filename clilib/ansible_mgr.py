@@ -1,11 +1,22 @@
+import json
 import logging
 import os
 import re
+import shutil
 import subprocess
+import sys
+import telemetry
 import utils
+import yaml
+from collections import OrderedDict
 from jinja2 import Environment, FileSystemLoader
 
 _SPACES = "   "
+# first line of the group_vars/host_vars files written by the 'vars_dirs' inventory layout
+_GENERATED_HEADER = "# generated by lusheeta-cli\n"
+# the inventory of the last prepare_ansible / of the last successful playbook run (for incremental runs)
+_INVENTORY_SNAPSHOT = 'ansible_inventory.json'
+_APPLIED_INVENTORY_SNAPSHOT = 'ansible_applied.json'
 
 
 #
@@ -66,12 +77,23 @@ class AnsibleManager:
     #
 
     #
-    def run_ansible_setup(self):
+    def run_ansible_setup(self, incremental=False):
+        """
+        Runs the playbook. In incremental mode the run is limited to the hosts that are new or changed since the last
+        successful run, and to the hosts of their dependent groups (ansible.dependent_groups).
+
+        :return: the exit code of ansible-playbook
+        """
         ansible_config = self.config['ansible']
 
         ansible_dir = ansible_config['ansible_dir']
-        playbook_path = os.path.abspath(os.path.join(
-            ansible_dir, ansible_config['playbook']))
+        playbook = ansible_config['playbook']
+        # nodes booted from baked images already have the stack, a short reconfiguration is enough
+        baked_playbook = ansible_config.get('baked_playbook')
+        if baked_playbook and all(host.get('baked_image') for host in self.config['hosts']):
+            self.logger.info("All host groups boot from baked images, running '%s'", baked_playbook)
+            playbook = baked_playbook
+        playbook_path = os.path.abspath(os.path.join(ansible_dir, playbook))
         project_path = os.path.abspath(self.config['project_path'])
 
         inventory_file = os.path.abspath(
@@ -79,8 +101,114 @@ class AnsibleManager:
         ansible_playbook_executable = os.path.abspath(os.path.join(
             ansible_config['ansible_bin_path'], 'ansible-playbook'))
 
-        subprocess.call([ansible_playbook_executable, playbook_path,
-                         '-i', inventory_file, '-vv'], cwd=project_path)
+        command = [ansible_playbook_executable, playbook_path, '-i', inventory_file, '-vv']
+        if incremental:
+            limit = self.get_incremental_limit()
+            if limit is not None and not limit:
+                self.logger.info("No host changed since the last successful run. Nothing to do...")
+                return 0
+            if limit:
+                self.logger.info("Incremental run limited to %s hosts: %s", len(limit), ", ".join(limit))
+                command += ['--limit', ",".join(limit)]
+
+        with telemetry.metrics.timer('playbook_seconds', help_text="Duration of ansible playbook runs",
+                                     playbook=playbook):
+            return_code = self._run_command(command, project_path)
+        telemetry.metrics.inc('playbook_runs_total', help_text="Ansible playbook runs", playbook=playbook,
+                              result='ok' if return_code == 0 else 'failed')
+
+        snapshot = os.path.join(project_path, _INVENTORY_SNAPSHOT)
+        if return_code == 0 and os.path.exists(snapshot):
+            shutil.copyfile(snapshot, os.path.join(project_path, _APPLIED_INVENTORY_SNAPSHOT))
+        return return_code
+
+    #
+
+    #
+    @staticmethod
+    def _run_command(command, cwd):
+        """
+        Runs the command and copies its output (stdout and stderr) line by line to sys.stdout, which the daemon routes
+        to the client of the request.
+
+        :return: the exit code of the command
+        """
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in iter(process.stdout.readline, b''):
+            sys.stdout.write(line if isinstance(line, str) else line.decode('utf-8', 'replace'))
+            sys.stdout.flush()
+        process.stdout.close()
+        return process.wait()
+
+    #
+
+    #
+    def get_incremental_limit(self):
+        """
+        Compares the current inventory with the last successfully applied one. The cached facts of the changed hosts
+        are dropped: a host recreated under the same name (e.g. a replaced node) has new facts.
+
+        :return: the sorted inventory host names to run on, or None if the whole inventory must be run (no applied
+                 inventory yet)
+        :rtype: list
+        """
+        project_path = self.config['project_path']
+        applied_path = os.path.join(project_path, _APPLIED_INVENTORY_SNAPSHOT)
+        if not os.path.exists(applied_path):
+            self.logger.info("No successfully applied inventory found. Running the whole inventory...")
+            return None
+
+        current_path = os.path.join(project_path, _INVENTORY_SNAPSHOT)
+        if not os.path.exists(current_path):
+            self.logger.error("No inventory snapshot '%s' found (is ansible.inventory_template set?). Running the "
+                              "whole inventory...", current_path)
+            return None
+
+        with open(applied_path, 'r') as applied_stream:
+            applied = self._hosts_of_inventory(json.load(applied_stream))
+        with open(current_path, 'r') as current_stream:
+            current_inventory = json.load(current_stream)
+        current = self._hosts_of_inventory(current_inventory)
+
+        # new, changed and removed hosts
+        changed = set(name for name in current if applied.get(name) != current[name])
+        changed |= set(name for name in applied if name not in current)
+        self._forget_cached_facts(changed)
+
+        # groups affected by the changes -> the groups that depend on them
+        affected_groups = set(group for name in changed for host_groups in (current.get(name), applied.get(name))
+                              if host_groups for group in host_groups)
+        dependent_groups = self.config['ansible']['dependent_groups']
+        limit = set(name for name in changed if name in current)
+        for group in affected_groups:
+            for dependent_group in dependent_groups.get(group) or []:
+                limit |= set(current_inventory.get(dependent_group, {}))
+
+        return sorted(limit)
+
+    #
+
+    #
+    def _forget_cached_facts(self, host_names):
+        """Removes the hosts from the jsonfile fact cache (one file per inventory host name)."""
+        facts_dir = os.path.join(self.config['project_path'], 'facts')
+        for host_name in host_names:
+            facts_file = os.path.join(facts_dir, host_name)
+            if os.path.exists(facts_file):
+                self.logger.debug("Removing the cached facts of '%s'", host_name)
+                os.remove(facts_file)
+
+    #
+
+    #
+    @staticmethod
+    def _hosts_of_inventory(inventory):
+        """ansible group -> host -> vars  ==>  host -> ansible group -> vars"""
+        hosts = {}
+        for group, group_hosts in inventory.items():
+            for name, host_vars in group_hosts.items():
+                hosts.setdefault(name, {})[group] = host_vars
+        return hosts
 
     #
 
@@ -93,9 +221,50 @@ class AnsibleManager:
         self.logger.info(
             "Generating ansible inventory file from template '%s'...", tpl_file)
 
-        hosts = self.config['hosts']
+        inventory = self.build_inventory(cloud_nodes)
 
+        layout = self.config['ansible']['inventory_layout']
         template_vars = {}
+        if layout == 'vars_dirs':
+            # slim membership lines, the vars go to group_vars/ and host_vars/ next to the inventory
+            for group, group_hosts in inventory.items():
+                template_vars[group] = list(group_hosts)
+            self._generate_vars_dirs(inventory)
+        elif layout == 'inline':
+            for group, group_hosts in inventory.items():
+                template_vars[group] = [inventory_host_name + _SPACES + _SPACES.join(
+                    ("%s=%s" % (k, v) for (k, v) in inventory_item.items()))
+                    for inventory_host_name, inventory_item in group_hosts.items()]
+            # the vars files of a previous 'vars_dirs' layout would still apply
+            self._write_vars_files('group_vars', {})
+            self._write_vars_files('host_vars', {})
+        else:
+            self.logger.error("Unknown ansible.inventory_layout '%s' (inline or vars_dirs). Quitting...", layout)
+            exit(1)
+
+        inventory_file_content = inventory_template.render(template_vars)
+        project_path = self.config['project_path']
+
+        target = os.path.join(project_path, 'ansible_inventory')
+        self.logger.info("Saving ansible inventory file to '%s'", target)
+        utils.save_string_to_file(inventory_file_content, target)
+
+        with open(os.path.join(project_path, _INVENTORY_SNAPSHOT), 'w') as snapshot_stream:
+            json.dump(inventory, snapshot_stream, indent=2, sort_keys=True)
+
+    #
+
+    #
+    def build_inventory(self, cloud_nodes):
+        """
+        Expands the ansible_settings of the hosts into the inventory.
+
+        :return: ansible group -> (inventory host name -> vars of the host in the group)
+        :rtype: OrderedDict
+        """
+        hosts = self.config['hosts']
+
+        inventory = OrderedDict()
 
         # iterate through all the the hosts defined
         for host in hosts:
@@ -114,8 +283,8 @@ class AnsibleManager:
                 for ans_setting in host_ansible_settings:
                     # get the array of the hosts for the inventory group so
                     # that we can add more
-                    inventory_group = template_vars.setdefault(
-                        ans_setting['ansible_group'], [])
+                    inventory_group = inventory.setdefault(
+                        ans_setting['ansible_group'], OrderedDict())
 
                     # we'll generate the string based on this dict
                     inventory_item = {}
@@ -148,29 +317,85 @@ class AnsibleManager:
 
                     # check group_vars -- entries with the proper index will be
                     # added
-                    group_vars = ans_setting.get('group_vars', []) or []
-                    for group_var in group_vars:
-                        # 'index' mandatory
-                        index = group_var['index']
-                        if index == i or index == 'all':
-                            for group_var_key in group_var:
-                                if group_var_key != 'index':
-                                    inventory_item[group_var_key] = group_var[group_var_key]
-                        if index == 'counter':
-                            for group_var_key in group_var:
-                                if group_var_key != 'index':
-                                    inventory_item[group_var_key] = str(i + 1)
-
-                    inventory_line = inventory_host_name + _SPACES + _SPACES.join(
-                        ("%s=%s" % (k, v) for (k, v) in inventory_item.items()))
-                    inventory_group.append(inventory_line)
+                    inventory_item.update(self._get_group_vars(ans_setting, i))
 
-        inventory_file_content = inventory_template.render(template_vars)
-        project_path = self.config['project_path']
+                    inventory_group[inventory_host_name] = inventory_item
 
-        target = os.path.join(project_path, 'ansible_inventory')
-        self.logger.info("Saving ansible inventory file to '%s'", target)
-        utils.save_string_to_file(inventory_file_content, target)
+        return inventory
+
+    #
+
+    #
+    def _generate_vars_dirs(self, inventory):
+        """
+        Splits the vars of the inventory into group_vars/<group>.yml and host_vars/<host>.yml files.
+
+        A var goes to the group's file if every member of the group (of more than one host) resolves it to the same
+        value, the rest stays in the host's file. A host's value is the one an inline inventory resolves: the vars of
+        its later groups override the earlier ones.
+        """
+        host_vars = OrderedDict()
+        for group_hosts in inventory.values():
+            for inventory_host_name, inventory_item in group_hosts.items():
+                host_vars.setdefault(inventory_host_name, {}).update(inventory_item)
+
+        group_vars = {}
+        factored = dict((inventory_host_name, set()) for inventory_host_name in host_vars)
+        for group, group_hosts in inventory.items():
+            members = list(group_hosts)
+            if len(members) < 2:
+                continue
+
+            first = host_vars[members[0]]
+            shared = dict((k, v) for k, v in first.items()
+                          if all(k in host_vars[member] and host_vars[member][k] == v for member in members[1:]))
+            if shared:
+                group_vars[group] = shared
+                for member in members:
+                    factored[member].update(shared)
+
+        self._write_vars_files('group_vars', group_vars)
+        self._write_vars_files('host_vars', dict(
+            (inventory_host_name, dict((k, v) for k, v in item.items() if k not in factored[inventory_host_name]))
+            for inventory_host_name, item in host_vars.items()))
+
+    #
+
+    #
+    def _write_vars_files(self, dir_name, vars_by_name):
+        """
+        Writes <project_path>/<dir_name>/<name>.yml for every non-empty entry, only if its content changed, and removes
+        the previously generated files that are not needed anymore.
+        """
+        vars_dir = os.path.join(self.config['project_path'], dir_name)
+        if not vars_by_name and not os.path.isdir(vars_dir):
+            return
+        if not os.path.isdir(vars_dir):
+            os.makedirs(vars_dir)
+
+        written = set()
+        for name, item_vars in vars_by_name.items():
+            if not item_vars:
+                continue
+            file_name = name + '.yml'
+            written.add(file_name)
+            content = _GENERATED_HEADER + yaml.safe_dump(item_vars, default_flow_style=False)
+            target = os.path.join(vars_dir, file_name)
+            if os.path.exists(target):
+                with open(target, 'r') as vars_stream:
+                    if vars_stream.read() == content:
+                        continue
+            self.logger.debug("Saving '%s'", target)
+            utils.save_string_to_file(content, target)
+
+        for file_name in os.listdir(vars_dir):
+            stale = os.path.join(vars_dir, file_name)
+            if file_name.endswith('.yml') and file_name not in written:
+                with open(stale, 'r') as vars_stream:
+                    generated = vars_stream.readline() == _GENERATED_HEADER
+                if generated:
+                    self.logger.debug("Removing stale '%s'", stale)
+                    os.remove(stale)
 
     #
 
@@ -254,7 +479,9 @@ class AnsibleManager:
             'ansible_dir': os.path.abspath(self.config['ansible']['ansible_dir']),
             'ssh_config_path': os.path.abspath(os.path.join(project_path, ssh_config_filename)),
             'ssh_private_key_path': os.path.abspath(os.path.join(project_path, ssh_key_name)),
-            'ssh_control_path': '~/.ssh/ansible-%r@%h:%p'
+            'ssh_control_path': '~/.ssh/ansible-%r@%h:%p',
+            'fact_cache_path': os.path.abspath(os.path.join(project_path, 'facts')),
+            'fact_cache_timeout': self.config['ansible']['fact_cache_timeout']
         }
 
         ansible_cfg_file_content = ansible_cfg_template.render(template_vars)
@@ -264,6 +491,71 @@ class AnsibleManager:
 
     #
 
+    #
+    def render_user_data(self, host, i):
+        """
+        Renders the cloud-init user data of the i-th node of the host group from its 'user_data_template'.
+
+        :return: the user data or None if the host group has no template
+        """
+        tpl_file = host.get('user_data_template')
+        if not tpl_file:
+            return None
+
+        user_data_template = self.j2_env.get_template(tpl_file)
+        return user_data_template.render(self.get_node_template_vars(host, i))
+
+    #
+
+    #
+    def get_node_template_vars(self, host, i):
+        """The variables of a node that are known before it boots (no ips yet)."""
+        cnt = host['count']
+        host_name = self.project_name + "-" + host['name']
+        inventory_host_name = host['name']
+        if cnt > 1:
+            host_name += "_" + str(i + 1)
+            inventory_host_name += "_" + str(i + 1)
+
+        node_vars = {}
+        ansible_groups = []
+        for ans_setting in host.get('ansible_settings', []):
+            ansible_groups.append(ans_setting['ansible_group'])
+            node_vars.update(self._get_group_vars(ans_setting, i))
+
+        return {
+            'project_name': self.project_name,
+            'host_name': host_name,
+            'inventory_host_name': inventory_host_name,
+            'host_group': host['name'],
+            'index': i,
+            'count': cnt,
+            'ansible_groups': ansible_groups,
+            'group_vars': node_vars
+        }
+
+    #
+
+    #
+    def _get_group_vars(self, ans_setting, i):
+        """The group_vars of the ansible setting that apply to the i-th node (index i, 'all' or 'counter')."""
+        node_vars = {}
+        group_vars = ans_setting.get('group_vars', []) or []
+        for group_var in group_vars:
+            # 'index' mandatory
+            index = group_var['index']
+            if index == i or index == 'all':
+                for group_var_key in group_var:
+                    if group_var_key != 'index':
+                        node_vars[group_var_key] = group_var[group_var_key]
+            if index == 'counter':
+                for group_var_key in group_var:
+                    if group_var_key != 'index':
+                        node_vars[group_var_key] = i + 1
+        return node_vars
+
+    #
+
     # ---------------------------------------------------------------------------------------------------------------- #
     # ### Substitution methods ###
     # ---------------------------------------------------------------------------------------------------------------- #
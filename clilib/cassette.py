@@ -0,0 +1,346 @@
+#
+# https://github.com/sperka/lusheeta
+#
+
+import collections
+import importlib
+import json
+import logging
+import threading
+import time
+import types
+
+_FORMAT_VERSION = 1
+
+# response attributes never written into a cassette
+_SECRET_ATTRIBUTES = ['private_key']
+
+
+#
+class CassetteError(Exception):
+    pass
+
+
+#
+class Cassette:
+    """
+    Records the cloud API traffic of a run (every network and compute call: arguments, response or error and latency)
+    into a JSON lines file and plays it back in place of the live connection.
+
+    Playback serves each call the recorded response of the same call with the same arguments (the first unused one;
+    if the arguments differ, e.g. a timestamped name, the first unused response of the same call) after sleeping the
+    recorded latency divided by `speed` (0: no sleeping). The poll intervals of the driver are scaled the same way
+    (see `sleep`).
+
+    Secrets of the responses (e.g. the private key of a created keypair) are not recorded.
+    """
+
+    #
+    def __init__(self, path, mode, speed=1.0):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+
+        if mode == 'record':
+            self._start_time = time.time()
+            self._stream = open(path, 'w')
+            self._write({'type': 'cassette', 'version': _FORMAT_VERSION, 'recorded_at': self._start_time})
+            self.logger.info("Recording the cloud API traffic into '%s'", path)
+        elif mode == 'replay':
+            self._load()
+            self.logger.info("Replaying the cloud API traffic from '%s' (%s calls, speed %s)", path,
+                             sum(len(calls) for calls in self._calls.values()), speed)
+        else:
+            raise ValueError("Unknown cassette mode '%s'" % mode)
+
+    #
+
+    #
+    @staticmethod
+    def from_options(options):
+        """
+        :return: the cassette of the 'record' / 'replay' (+ 'replay_speed') options, None if neither is set
+        :rtype: Cassette
+        """
+        if options.get('record'):
+            return Cassette(options['record'], 'record')
+        if options.get('replay'):
+            speed = options.get('replay_speed')
+            return Cassette(options['replay'], 'replay', 1.0 if speed is None else speed)
+        return None
+
+    #
+
+    #
+    def wrap_connection(self, connection_factory, region):
+        """
+        :param connection_factory: creates the live connection (only called in record mode)
+        :return: the live connection with recording network/compute proxies, or a replayed connection
+        """
+        if self.mode == 'replay':
+            return _ReplayedConnection(self, region)
+
+        conn = connection_factory()
+        self._write({'type': 'connection', 'region': region, 'project_id': conn.current_project_id})
+        return _RecordingConnection(conn, self, region)
+
+    #
+
+    #
+    def sleep(self, seconds):
+        """Waits like `time.sleep`, divided by the replay speed when replaying."""
+        if self.mode == 'replay':
+            seconds = float(seconds) / self.speed if self.speed else 0
+        if seconds:
+            time.sleep(seconds)
+
+    #
+
+    #
+    def close(self):
+        if self.mode == 'record':
+            with self._lock:
+                self._stream.close()
+
+    #
+
+    #
+    def record_call(self, region, api_name, call, args, kwargs, start_time, result=None, error=None,
+                    generator=False, duration=None):
+        """:param duration: the time spent in the API, by default since `start_time`"""
+        if duration is None:
+            duration = time.time() - start_time
+        entry = {'type': 'call', 'region': region, 'api': api_name, 'call': call, 'key': _call_key(args, kwargs),
+                 'start': start_time - self._start_time, 'duration': duration}
+        if error is not None:
+            entry['error'] = {'module': type(error).__module__, 'class': type(error).__name__, 'message': str(error)}
+        else:
+            entry['result'] = _serialize(result)
+            entry['generator'] = generator
+        self._write(entry)
+
+    #
+
+    #
+    def replay_call(self, region, api_name, call, args, kwargs):
+        key = _call_key(args, kwargs)
+        with self._lock:
+            entry = self._take(self._calls_by_key.get((region, api_name, call, key)))
+            if entry is None:
+                entry = self._take(self._calls.get((region, api_name, call)))
+        if entry is None:
+            raise CassetteError("No recorded response left for %s.%s(%s) in region '%s'" % (api_name, call, key,
+                                                                                            region))
+
+        if self.speed:
+            time.sleep(entry['duration'] / self.speed)
+
+        if 'error' in entry:
+            raise _replayed_error(entry['error'])
+
+        result = _deserialize(entry['result'])
+        if entry.get('generator'):
+            return (item for item in result)
+        return result
+
+    #
+
+    #
+    def project_id(self, region):
+        return self._project_ids.get(region)
+
+    #
+
+    #
+    def _write(self, entry):
+        line = json.dumps(entry, default=_json_default)
+        with self._lock:
+            self._stream.write(line + "\n")
+            self._stream.flush()
+
+    #
+
+    #
+    def _load(self):
+        self._project_ids = {}
+        self._calls = collections.OrderedDict()
+        self._calls_by_key = {}
+        with open(self.path, 'r') as cassette_stream:
+            for line in cassette_stream:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry['type'] == 'connection':
+                    self._project_ids[entry['region']] = entry['project_id']
+                elif entry['type'] == 'call':
+                    entry['used'] = False
+                    self._calls.setdefault((entry['region'], entry['api'], entry['call']),
+                                           collections.deque()).append(entry)
+                    self._calls_by_key.setdefault((entry['region'], entry['api'], entry['call'], entry['key']),
+                                                  collections.deque()).append(entry)
+
+    #
+
+    #
+    @staticmethod
+    def _take(entries):
+        while entries:
+            entry = entries.popleft()
+            if not entry['used']:
+                entry['used'] = True
+                return entry
+        return None
+
+
+#
+class _RecordingApi:
+    def __init__(self, api, api_name, cassette, region):
+        self._api = api
+        self._api_name = api_name
+        self._cassette = cassette
+        self._region = region
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start_time = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                self._cassette.record_call(self._region, self._api_name, name, args, kwargs, start_time, error=e)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return self._record_generator(name, args, kwargs, start_time, result)
+            self._cassette.record_call(self._region, self._api_name, name, args, kwargs, start_time, result=result)
+            return result
+
+        return call
+
+    def _record_generator(self, name, args, kwargs, start_time, generator):
+        # recorded when exhausted or abandoned (e.g. next(iter(...))), with the items consumed so far; the duration
+        # is the time spent fetching the items, not the time the consumer spent between them
+        items = []
+        duration = time.time() - start_time
+        try:
+            while True:
+                fetch_start = time.time()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    break
+                finally:
+                    duration += time.time() - fetch_start
+                items.append(item)
+                yield item
+        finally:
+            self._cassette.record_call(self._region, self._api_name, name, args, kwargs, start_time, result=items,
+                                       generator=True, duration=duration)
+
+
+#
+class _RecordingConnection:
+    def __init__(self, conn, cassette, region):
+        self._conn = conn
+        self.network = _RecordingApi(conn.network, 'network', cassette, region)
+        self.compute = _RecordingApi(conn.compute, 'compute', cassette, region)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+#
+class _ReplayedApi:
+    def __init__(self, api_name, cassette, region):
+        self._api_name = api_name
+        self._cassette = cassette
+        self._region = region
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self._cassette.replay_call(self._region, self._api_name, name, args, kwargs)
+
+
+#
+class _ReplayedConnection:
+    def __init__(self, cassette, region):
+        self.network = _ReplayedApi('network', cassette, region)
+        self.compute = _ReplayedApi('compute', cassette, region)
+        # not recorded, the driver doesn't call them
+        self.cluster = None
+        self.identity = None
+        self.current_project_id = cassette.project_id(region)
+
+
+#
+class ReplayedResource(dict):
+    """A recorded SDK resource: its attributes are readable as attributes (server.name) and as keys (rule['id'])."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def to_dict(self, **kwargs):
+        return dict(self)
+
+
+def _json_default(value):
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    return repr(value)
+
+
+def _serialize(value):
+    if hasattr(value, 'to_dict'):
+        attrs = json.loads(json.dumps(value.to_dict(), default=_json_default))
+        for name in _SECRET_ATTRIBUTES:
+            if attrs.get(name) is not None:
+                attrs[name] = None
+        return {'__resource__': type(value).__name__, 'attrs': attrs}
+    if isinstance(value, (list, tuple)):
+        return [_serialize(item) for item in value]
+    return json.loads(json.dumps(value, default=_json_default))
+
+
+def _deserialize(value):
+    # the nested resources are plain dicts in to_dict() (e.g. the 'absolute' limits), they are read as attributes too
+    if isinstance(value, dict) and '__resource__' in value:
+        return _deserialize(value['attrs'])
+    if isinstance(value, dict):
+        return ReplayedResource((k, _deserialize(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_deserialize(item) for item in value]
+    return value
+
+
+def _normalize(value):
+    # resource classes (e.g. of proxy._create) by their names
+    if isinstance(value, type):
+        return value.__name__
+    # resources are identified by their IDs (the same object may be passed whole or as an ID)
+    if hasattr(value, 'to_dict') and getattr(value, 'id', None):
+        return value.id
+    if isinstance(value, dict):
+        return dict((str(k), _normalize(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _call_key(args, kwargs):
+    return json.dumps([_normalize(list(args)), _normalize(kwargs)], sort_keys=True, default=_json_default)
+
+
+def _replayed_error(error):
+    try:
+        error_class = getattr(importlib.import_module(error['module']), error['class'])
+        return error_class(error['message'])
+    except Exception:
+        return CassetteError("%s: %s" % (error['class'], error['message']))
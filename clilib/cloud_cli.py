@@ -4,14 +4,20 @@
 
 import logging
 import os
+import shutil
+import tempfile
 import time
+import telemetry
 import utils
 
 from ansible_mgr import AnsibleManager
+from cassette import Cassette
+from state_journal import StateJournal
+from timings import TIMINGS_FILE, TimingHistory
 
 
 class CloudCLI:
-    def __init__(self, action, config, project_name):
+    def __init__(self, action, config, project_name, options=None):
         self.logger = logging.getLogger(__name__)
 
         self.preprocess_config(config)
@@ -19,6 +25,10 @@ class CloudCLI:
         self.action = action
         self.config = config
         self.project_name = project_name
+        # action modifiers passed on the command line (e.g. 'offline')
+        self.options = options or {}
+        # records / replays the cloud API traffic of the drivers (options 'record' / 'replay')
+        self.cassette = Cassette.from_options(self.options)
 
         # make sure "platform" is set in config
         if not config['platform']:
@@ -28,7 +38,8 @@ class CloudCLI:
         platforms = utils.load_supported_platforms_config()
         assert (platform_name in platforms)
 
-        platform = platforms[platform_name]
+        # a copy, the daemon loads projects of different platform settings files
+        platform = dict(platforms[platform_name])
 
         # platform_settings_file check
         if 'platform_settings_file' in config:
@@ -36,6 +47,8 @@ class CloudCLI:
 
         config['platform_settings'] = platform
 
+        if self.options.get('replay'):
+            self.use_scratch_projects_dir()
         self.project_path = os.path.join(self.config['projects_dir'], self.config['project'])
         # save it to config, we'll need it later
         config['project_path'] = self.project_path
@@ -43,7 +56,22 @@ class CloudCLI:
         self.logger.info("Instantiating class '%s' for platform '%s'", platform['class_name'], platform_name)
         _PLATFORM_CLASS = utils.import_platform_class(platform['package_name'], platform['module_name'],
                                                       platform['class_name'])
-        self.platform_driver = _PLATFORM_CLASS(config, project_name)
+        self.platform_driver = _PLATFORM_CLASS(config, project_name, cassette=self.cassette)
+
+        # one driver (connection) per region the nodes are placed in, the default region's driver comes first
+        default_region = getattr(self.platform_driver, 'region_name', None)
+        self.platform_drivers = []
+        for region in self.get_node_regions():
+            region = region or default_region
+            if region == default_region:
+                if self.platform_driver not in self.platform_drivers:
+                    self.platform_drivers.insert(0, self.platform_driver)
+            elif region not in [d.region_name for d in self.platform_drivers]:
+                self.logger.info("Instantiating class '%s' for region '%s'", platform['class_name'], region)
+                self.platform_drivers.append(_PLATFORM_CLASS(config, project_name, region=region,
+                                                             cassette=self.cassette))
+        if not self.platform_drivers:
+            self.platform_drivers = [self.platform_driver]
 
     #
 
@@ -58,7 +86,105 @@ class CloudCLI:
             self.logger.error("There is no %s action defined in this class. Quitting...", self.action)
             exit(1)
 
-        action_fn()
+        # every action gets a registry of its own, the daemon runs the actions of different projects concurrently
+        registry = telemetry.MetricsRegistry()
+        registry.const_labels = {'project': self.project_name}
+        with telemetry.metrics_scope(registry):
+            try:
+                with telemetry.metrics.timer('action_seconds', help_text="Duration of CLI actions",
+                                             action=self.action):
+                    action_fn()
+            finally:
+                self.export_metrics()
+                self.save_timings(registry)
+                if self.cassette:
+                    self.cassette.close()
+
+    #
+
+    #
+    def reuse(self, action, options=None):
+        """
+        Prepares this (warm) instance for running another action, used by the daemon: the connections and the
+        caches of cloud-wide resources (images, flavors, ext-net) are kept, the project's resource caches are dropped.
+        """
+        self.action = action
+        self.options = options or {}
+        for driver in self.platform_drivers:
+            if hasattr(driver, 'reset_project_caches'):
+                driver.reset_project_caches()
+
+    #
+
+    #
+    def for_each_region(self, fn):
+        """Calls fn with the driver of every region concurrently and returns the results."""
+        return utils.run_concurrently(fn, self.platform_drivers, len(self.platform_drivers))
+
+    #
+
+    #
+    def use_scratch_projects_dir(self):
+        """
+        Points the config to a scratch copy of the project: a replay is a benchmark, it must not change the state
+        journal, the ssh key or the ansible files of the real project.
+        """
+        project_path = os.path.join(self.config['projects_dir'], self.config['project'])
+        scratch_dir = tempfile.mkdtemp(prefix='lusheeta-replay-')
+        if os.path.isdir(project_path):
+            shutil.copytree(project_path, os.path.join(scratch_dir, self.config['project']))
+        self.logger.info("Replaying in the scratch projects dir '%s', '%s' is left alone", scratch_dir, project_path)
+        self.config['projects_dir'] = scratch_dir
+
+    #
+
+    #
+    def get_node_regions(self):
+        """
+        :return: the regions set for the nodes (host 'region' or 'region' in cloud_vars), None for the default region
+        :rtype: list
+        """
+        regions = []
+        for host in self.config['hosts']:
+            host_regions = [cv['region'] for cv in host['cloud_vars'] if cv.get('region')]
+            # nodes not covered by a per-index region use the host group's region
+            if not any(cv.get('region') and cv['index'] == 'all' for cv in host['cloud_vars']):
+                host_regions.append(host.get('region'))
+            for region in host_regions:
+                if region not in regions:
+                    regions.append(region)
+        return regions
+
+    #
+
+    #
+    def export_metrics(self):
+        """Writes the metrics of the action as a Prometheus textfile into the project dir (if it exists)."""
+        metrics_file = self.config['telemetry']['metrics_file']
+        if not metrics_file or not os.path.isdir(self.project_path):
+            return
+
+        target = os.path.join(self.project_path, metrics_file)
+        self.logger.debug("Saving metrics to '%s'", target)
+        telemetry.metrics.write_textfile(target)
+
+    #
+
+    #
+    def save_timings(self, registry):
+        """
+        Adds the durations observed by the action to the project's timing history (used by the 'plan' action).
+
+        :param registry: the metrics registry of the action, other actions of the daemon don't observe into it
+        """
+        if self.options.get('replay') or not os.path.isdir(self.project_path):
+            return
+
+        target = os.path.join(self.project_path, TIMINGS_FILE)
+        history = TimingHistory.load(target)
+        history.merge_histograms(registry.histograms())
+        self.logger.debug("Saving timings to '%s'", target)
+        history.save(target)
 
     #
 
@@ -69,24 +195,34 @@ class CloudCLI:
             1. Create a project folder
             2. Copy config item there
             3. Run driver's create_cluster method
+
+            In 'resume' mode the existing project folder (and its state journal) is kept and the driver continues from
+            the last checkpoint.
         """
-        # 1
-        self.logger.info("Creating project dir '%s'", self.project_path)
-        if os.path.exists(self.project_path):
-            backup_path = os.path.join(self.config['projects_dir'],
-                                       self.config['project'] + "-backup-" + time.strftime('%Y%m%d-%I%M%S'))
-            self.logger.warn("Project directory exists with the same name ('%s'). Backing up content into '%s'",
-                             self.project_path, backup_path)
-            os.rename(self.project_path, backup_path)
+        resume = self.options.get('resume')
 
-        os.makedirs(self.project_path)
+        # 1
+        if resume:
+            if not StateJournal.project_journals(self.project_path):
+                self.logger.error("No state journal found in '%s'. Nothing to resume. Quitting...", self.project_path)
+                exit(1)
+        else:
+            self.logger.info("Creating project dir '%s'", self.project_path)
+            if os.path.exists(self.project_path):
+                backup_path = os.path.join(self.config['projects_dir'],
+                                           self.config['project'] + "-backup-" + time.strftime('%Y%m%d-%I%M%S'))
+                self.logger.warn("Project directory exists with the same name ('%s'). Backing up content into '%s'",
+                                 self.project_path, backup_path)
+                os.rename(self.project_path, backup_path)
+
+            os.makedirs(self.project_path)
 
         # 2
         self.logger.debug("Saving current config to project dir...")
         utils.write_yaml_config(os.path.join(self.project_path, "config.yml"), self.config)
 
         # 3
-        self.platform_driver.create_cluster()
+        self.for_each_region(lambda driver: driver.create_cluster(resume=resume))
         return
 
     #
@@ -94,14 +230,24 @@ class CloudCLI:
     #
     def cleanup(self):
         """Cleanup the cluster from the cloud"""
-        self.platform_driver.cleanup_cluster()
+        self.for_each_region(lambda driver: driver.cleanup_cluster())
 
     #
 
     #
     def prepare_ansible(self):
-        """Prepare required ansible files: inventory, ssh.config, ansible.cfg"""
-        nodes = self.list_nodes()
+        """Prepare required ansible files: inventory, ssh.config, ansible.cfg
+
+        In 'offline' mode the nodes are read from the project's state journal and no cloud API call is made.
+        """
+        if self.options.get('offline'):
+            if not StateJournal.project_journals(self.project_path):
+                self.logger.error("No state journal found in '%s'. Can't prepare ansible files offline. Quitting...",
+                                  self.project_path)
+                exit(1)
+            nodes = [node for nodes in self.for_each_region(lambda driver: driver.journal_nodes()) for node in nodes]
+        else:
+            nodes = self.list_nodes()
         AnsibleManager(self.config, self.project_name).prepare_files(nodes)
 
     #
@@ -109,14 +255,108 @@ class CloudCLI:
     #
     def run_ansible(self):
         """Run the ansible setup on the cluster in the cloud"""
-        AnsibleManager(self.config, self.project_name).run_ansible_setup()
-        return
+        incremental = self.options.get('incremental') or self.config['ansible']['incremental']
+        return_code = AnsibleManager(self.config, self.project_name).run_ansible_setup(incremental=incremental)
+        if return_code != 0:
+            self.logger.error("Ansible setup failed (exit code %s)", return_code)
+            exit(return_code)
+
+    #
+
+    #
+    def bake(self):
+        """Snapshot the configured node of each host group into a golden image (run after a successful run_ansible)"""
+        self.for_each_region(lambda driver: driver.bake_images())
+
+    #
+
+    #
+    def apply_security_group(self):
+        """Apply the changes of the declared security group rules to the project's security group"""
+        self.for_each_region(lambda driver: driver.apply_security_group_rules())
+
+    #
+
+    #
+    def gc(self):
+        """Find orphaned project resources in the whole tenant and report them, delete them only in 'yes' mode"""
+        self.for_each_region(lambda driver: driver.garbage_collect(delete=self.options.get('yes')))
+
+    #
+
+    #
+    def status(self):
+        """Print a table of the project's nodes while they are streamed from the cloud, region by region"""
+        node_status = self.options.get('node_status')
+        row_format = "%-40s %-38s %-10s %-16s %s"
+        print(row_format % ("NAME", "ID", "STATUS", "REGION", "ADDRESSES"))
+
+        for driver in self.platform_drivers:
+            region = getattr(driver, 'region_name', None) or '-'
+            expected = [driver.get_host_name(host, i) for host, i in driver.iterate_nodes()]
+            for node in driver.iter_nodes(status=node_status):
+                addresses = ", ".join(address['addr'] for network_addresses in (node.addresses or {}).values()
+                                      for address in network_addresses)
+                print(row_format % (node.name, node.id, node.status, region, addresses))
+                if node.name in expected:
+                    expected.remove(node.name)
+
+            # the configured nodes that don't exist (only meaningful without a status filter)
+            if not node_status:
+                for name in expected:
+                    print(row_format % (name, "-", "MISSING", region, ""))
+
+    #
+
+    #
+    def plan(self):
+        """Print the operations, the API calls and the estimated wall time of 'create' (or of the 'plan_action' option,
+        e.g. 'cleanup') without touching the cloud"""
+        plan_action = self.options.get('plan_action') or 'create'
+        resume = self.options.get('resume')
+
+        # the project's own history, then the one of all the projects (same cloud), then the defaults of the driver
+        history = TimingHistory.load(os.path.join(self.project_path, TIMINGS_FILE))
+        timings_source = "project history"
+        if not history.samples():
+            history = TimingHistory.load_all(self.config['projects_dir'])
+            timings_source = "history of all projects" if history.samples() else "defaults"
+
+        row_format = "%4s  %-16s %-8s %-15s %-45s %6s %9s"
+        print("Plan for '%s' of project '%s'%s" % (plan_action, self.project_name,
+                                                   " (resume)" if resume and plan_action == 'create' else ""))
+        print(row_format % ("#", "REGION", "OP", "TYPE", "NAME", "CALLS", "SECONDS"))
+
+        calls_by_api = {}
+        wall_time = 0.0
+        number = 0
+        for driver in self.platform_drivers:
+            region = getattr(driver, 'region_name', None) or '-'
+            plan = driver.plan(plan_action, history, resume=resume)
+            for note in plan['notes']:
+                self.logger.warn("%s: %s", region, note)
+
+            for op in plan['ops']:
+                number += 1
+                print(row_format % (number, region, op['op'], op['type'], op['name'], len(op['calls']),
+                                    "%.1f" % op['seconds']))
+                for api, _ in op['calls']:
+                    calls_by_api[api] = calls_by_api.get(api, 0) + 1
+
+            # the regions run concurrently
+            wall_time = max(wall_time, plan['graph'].simulate(dict((op['step'], op['seconds'])
+                                                                   for op in plan['ops'])))
+
+        print("API calls: %s (%s)" % (sum(calls_by_api.values()),
+                                      ", ".join("%s: %s" % item for item in sorted(calls_by_api.items()))))
+        print("Estimated wall time: %dm %02ds (timings: %s, %s samples)" % (
+            int(wall_time) // 60, int(wall_time) % 60, timings_source, history.samples()))
 
     #
 
     #
     def list_nodes(self):
-        return self.platform_driver.list_nodes()
+        return [node for nodes in self.for_each_region(lambda driver: driver.list_nodes()) for node in nodes]
 
     #
 
@@ -130,11 +370,23 @@ class CloudCLI:
         network.setdefault('cidr_template', '10.X.100.0/24')
         network.setdefault('ext_net_name', 'ext-net')
 
+        security_group = config.setdefault('security_group', {})
+        rules = security_group.setdefault('rules', [
+            {'direction': 'ingress', 'protocol': 'tcp', 'port_range_min': 1, 'port_range_max': 65535},
+            {'direction': 'egress', 'protocol': 'tcp', 'port_range_min': 1, 'port_range_max': 65535}
+        ])
+        for rule in rules:
+            rule.setdefault('ether_type', 'IPv4')
+
         vm_mgmt = config.setdefault('vm_management', {})
         vm_mgmt.setdefault('default_image_name', 'Ubuntu 14.04.2_20150505')
         vm_mgmt.setdefault('default_vm_flavor', 'm1.medium')
         vm_mgmt.setdefault('hosts_startup_timeout', 600)
         vm_mgmt.setdefault('terminate_vm_poll', 5)
+        vm_mgmt.setdefault('max_parallel', 10)
+        vm_mgmt.setdefault('check_resources', True)
+        vm_mgmt.setdefault('precreate_ports', False)
+        vm_mgmt.setdefault('multi_create', False)
 
         hosts = config.setdefault('hosts', [])
         for host in hosts:
@@ -143,7 +395,23 @@ class CloudCLI:
             for cv in cloud_vars:
                 cv.setdefault('index', 'all')
 
+        telemetry_settings = config.setdefault('telemetry', {})
+        telemetry_settings.setdefault('log_file', 'cloud_cli.log')
+        telemetry_settings.setdefault('json_logs', True)
+        telemetry_settings.setdefault('metrics_file', 'metrics.prom')
+
+        config.setdefault('regions', {})
+
+        gc = config.setdefault('gc', {})
+        gc.setdefault('min_age_hours', 1)
+        gc.setdefault('stale_age_hours', 0)
+        gc.setdefault('max_workers', 8)
+
         ansible = config.setdefault('ansible', {})
         ansible.setdefault('ansible_dir', '../ansible/')
         ansible.setdefault('playbook', 'playbooks/setup_mesos_cluster.yml')
         ansible.setdefault('templates_path', './example/templates')
+        ansible.setdefault('inventory_layout', 'inline')
+        ansible.setdefault('fact_cache_timeout', 86400)
+        ansible.setdefault('incremental', False)
+        ansible.setdefault('dependent_groups', {})
@@ -0,0 +1,289 @@
+#
+# https://github.com/sperka/lusheeta
+#
+
+import itertools
+import json
+import logging
+import os
+import socket
+import sys
+import telemetry
+import threading
+import time
+import utils
+
+from cloud_cli import CloudCLI
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser('~'), '.lusheeta', 'daemon.sock')
+
+# the actions a daemon runs ('ping' is answered by the daemon itself)
+DAEMON_ACTIONS = ["create", "cleanup", "prepare_ansible", "run_ansible", "bake", "gc", "apply_security_group",
+                  "status", "plan"]
+
+
+def send_message(stream, message, lock=None):
+    data = (json.dumps(message) + "\n").encode('utf-8')
+    if lock:
+        with lock:
+            stream.write(data)
+            stream.flush()
+    else:
+        stream.write(data)
+        stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def forward(request, socket_path=DEFAULT_SOCKET_PATH):
+    """
+    Sends the request to the daemon listening on socket_path and prints its logs (stderr) and output (stdout) while
+    the action runs.
+
+    :return: the exit code of the action, None if no daemon is running (or it can't serve the request)
+    """
+    if not os.path.exists(socket_path):
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        # stale socket file, the daemon is gone
+        client.close()
+        return None
+
+    try:
+        stream = client.makefile('rwb')
+        send_message(stream, request)
+        while True:
+            message = read_message(stream)
+            if message is None:
+                sys.stderr.write("Connection to the daemon lost\n")
+                return 1
+            if 'log' in message:
+                sys.stderr.write(message['log'] + "\n")
+            elif 'output' in message:
+                sys.stdout.write(message['output'])
+                sys.stdout.flush()
+            else:
+                if message.get('error'):
+                    fallback = ", running the action in this process" if message.get('return_code') is None else ""
+                    sys.stderr.write("Daemon: %s%s\n" % (message['error'], fallback))
+                return message.get('return_code')
+    finally:
+        client.close()
+
+
+#
+class _ClientLogHandler(logging.Handler):
+    """Streams the log records of one request to its client."""
+
+    def __init__(self, request_id, stream, stream_lock, level):
+        logging.Handler.__init__(self, level)
+        self.request_id = request_id
+        self.stream = stream
+        self.stream_lock = stream_lock
+        self.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+
+    def emit(self, record):
+        if getattr(record, 'request', None) != self.request_id:
+            return
+        try:
+            send_message(self.stream, {'log': self.format(record)}, self.stream_lock)
+        except Exception:
+            # the client went away, the action goes on
+            pass
+
+
+#
+class _RoutedStdout:
+    """Sends what a request's threads print to its client, everything else to the daemon's own stdout."""
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.routes = {}
+
+    def write(self, text):
+        route = self.routes.get(telemetry.get_context().get('request'))
+        if route:
+            route(text)
+        else:
+            self.stdout.write(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+#
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = read_message(self.rfile)
+        if request is not None:
+            self.server.lusheeta_daemon.handle_request(request, self.wfile)
+
+
+#
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+#
+class LusheetaDaemon:
+    """
+    Serves CLI requests over a Unix socket from a long-running process.
+
+    The process keeps a warm CloudCLI per project and config file: the SDK is imported, the connections are
+    authenticated and the catalog and cloud-wide resource caches are filled only once. The requests of different
+    projects run concurrently, the ones of the same project one after the other.
+    """
+
+    #
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.socket_path = socket_path
+        self.cwd = os.getcwd()
+        self.start_time = time.time()
+
+        # (config file, project) -> {'mtime': .., 'cli': CloudCLI}
+        self.contexts = {}
+        self._contexts_lock = threading.Lock()
+        self._project_locks = {}
+        self._running = {}
+        self._request_ids = itertools.count(1)
+        self._stdout = None
+
+    #
+
+    #
+    def serve_forever(self):
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        if os.path.exists(self.socket_path):
+            if forward({'action': 'ping'}, self.socket_path) is not None:
+                self.logger.error("A daemon is already listening on '%s'. Quitting...", self.socket_path)
+                exit(1)
+            self.logger.info("Removing stale socket '%s'", self.socket_path)
+            os.remove(self.socket_path)
+
+        server = _UnixServer(self.socket_path, _RequestHandler)
+        server.lusheeta_daemon = self
+        os.chmod(self.socket_path, 0o600)
+
+        self._stdout = _RoutedStdout(sys.stdout)
+        sys.stdout = self._stdout
+
+        self.logger.info("Lusheeta daemon (pid %s) listening on '%s'...", os.getpid(), self.socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("Stopping Lusheeta daemon...")
+        finally:
+            server.server_close()
+            sys.stdout = self._stdout.stdout
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    #
+
+    #
+    def handle_request(self, request, stream):
+        stream_lock = threading.Lock()
+        action = request.get('action')
+
+        if action == 'ping':
+            send_message(stream, {'return_code': 0, 'pid': os.getpid(), 'cwd': self.cwd,
+                                  'uptime': time.time() - self.start_time, 'running': dict(self._running)})
+            return
+
+        # relative paths in the config (projects_dir, templates, ...) are resolved against the working directory
+        if request.get('cwd') != self.cwd:
+            send_message(stream, {'return_code': None, 'error': "The daemon runs in '%s'" % self.cwd})
+            return
+
+        project_name = request.get('project')
+        if action not in DAEMON_ACTIONS or not project_name:
+            send_message(stream, {'return_code': 2, 'error': "Invalid request: %s" % request})
+            return
+
+        request_id = next(self._request_ids)
+        log_handler = _ClientLogHandler(request_id, stream, stream_lock, request.get('log_level', logging.INFO))
+        telemetry.add_log_handler(log_handler)
+        self._stdout.routes[request_id] = lambda text: send_message(stream, {'output': text}, stream_lock)
+        try:
+            with telemetry.log_context(project=project_name, action=action, request=request_id):
+                return_code = self.run_action(request)
+        finally:
+            telemetry.remove_log_handler(log_handler)
+            del self._stdout.routes[request_id]
+
+        send_message(stream, {'return_code': return_code}, stream_lock)
+
+    #
+
+    #
+    def run_action(self, request):
+        """
+        :return: the exit code of the action
+        """
+        project_name = request['project']
+        with self._project_lock(project_name):
+            self._running[project_name] = request['action']
+            try:
+                cli = self.get_cli(request['config_file'], project_name)
+                cli.reuse(request['action'], request.get('options'))
+                self.logger.info("Running '%s' for project '%s'...", request['action'], project_name)
+                cli.run()
+                return 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    return e.code or 0
+                return 1
+            except Exception:
+                self.logger.exception("Action '%s' failed for project '%s'", request['action'], project_name)
+                return 1
+            finally:
+                del self._running[project_name]
+
+    #
+
+    #
+    def get_cli(self, config_file, project_name):
+        """
+        :return: the warm CloudCLI of the project, a new one if the config file changed since it was created
+        :rtype: CloudCLI
+        """
+        key = (config_file, project_name)
+        mtime = os.path.getmtime(config_file)
+
+        context = self.contexts.get(key)
+        if context and context['mtime'] == mtime:
+            return context['cli']
+
+        self.logger.info("Loading config '%s' for project '%s'...", config_file, project_name)
+        cli_config = utils.load_yaml_config(config_file)
+        cli_config['project'] = project_name
+        cli = CloudCLI(action=None, config=cli_config, project_name=project_name)
+        self.contexts[key] = {'mtime': mtime, 'cli': cli}
+        return cli
+
+    #
+
+    #
+    def _project_lock(self, project_name):
+        with self._contexts_lock:
+            return self._project_locks.setdefault(project_name, threading.Lock())
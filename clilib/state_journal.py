@@ -0,0 +1,217 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+
+#
+class StateJournal:
+    """
+    Append-only JSON lines journal of the cloud resources created for a project.
+
+    Every line is one event: 'add' (resource created), 'update' (resource data changed) or 'remove' (resource deleted).
+    The current state is the replay of all events, so a crash in the middle of a create/cleanup never leaves the
+    journal in a half-written state (at most the last line is lost).
+
+    The replayed state is kept in memory and updated by every append. The file is replayed again only if it changed
+    underneath (another process appended to it, or it was moved away by a new create).
+    """
+
+    #
+    def __init__(self, project_path, file_name='state.jsonl'):
+        self.logger = logging.getLogger(__name__)
+        self.path = os.path.join(project_path, file_name)
+        self._lock = threading.Lock()
+        # resource type -> OrderedDict(name -> {'id': .., 'data': {..}}), replayed from the file identified by _file_id
+        self._state = None
+        self._file_id = None
+
+    #
+
+    #
+    @staticmethod
+    def file_name_for_region(region=None):
+        """The journal of the default region is 'state.jsonl', the one of any other region is 'state-<region>.jsonl'."""
+        return 'state-%s.jsonl' % region if region else 'state.jsonl'
+
+    #
+
+    #
+    @staticmethod
+    def project_journals(project_path):
+        """
+        :return: the journals of all the regions of the project
+        :rtype: list of :class:`StateJournal`
+        """
+        return [StateJournal(project_path, os.path.basename(path))
+                for path in sorted(glob.glob(os.path.join(project_path, 'state*.jsonl')))]
+
+    #
+
+    #
+    def exists(self):
+        return os.path.exists(self.path)
+
+    #
+
+    #
+    def record(self, resource_type, name, resource_id, **data):
+        """Records a newly created resource."""
+        self._append('add', resource_type, name, resource_id, data)
+
+    #
+
+    #
+    def update(self, resource_type, name, **data):
+        """Merges data into an already recorded resource."""
+        self._append('update', resource_type, name, None, data)
+
+    #
+
+    #
+    def forget(self, resource_type, name):
+        """Records the deletion of a resource."""
+        self._append('remove', resource_type, name, None, {})
+
+    #
+
+    #
+    def forget_ids(self, resource_ids):
+        """Records the deletion of every live resource whose ID is in resource_ids."""
+        with self._lock:
+            forgotten = [(resource_type, name) for resource_type, entries in self._current_state().items()
+                         for name, entry in entries.items() if entry['id'] in resource_ids]
+        for resource_type, name in forgotten:
+            self.forget(resource_type, name)
+
+    #
+
+    #
+    def resources(self, resource_type):
+        """
+        :return: the live resources of the given type in creation order (name -> {'id': .., 'data': {..}}), a copy
+                 that stays valid while resources are forgotten
+        :rtype: OrderedDict
+        """
+        with self._lock:
+            return OrderedDict((name, _copy_entry(entry))
+                               for name, entry in self._current_state().get(resource_type, {}).items())
+
+    #
+
+    #
+    def get(self, resource_type, name):
+        with self._lock:
+            entry = self._current_state().get(resource_type, {}).get(name)
+            return _copy_entry(entry) if entry else None
+
+    #
+
+    #
+    def is_empty(self):
+        """:return: True if no live resource is recorded (checkpoints don't count)"""
+        with self._lock:
+            return not any(entries for resource_type, entries in self._current_state().items()
+                           if resource_type != 'checkpoint')
+
+    #
+
+    #
+    def checkpoint(self, step):
+        """Records that a step of the cluster creation completed."""
+        self._append('add', 'checkpoint', step, None, {})
+
+    #
+
+    #
+    def is_checkpointed(self, step):
+        return self.get('checkpoint', step) is not None
+
+    #
+
+    #
+    def clear_checkpoints(self):
+        """Forgets the completed steps, a create after a cleanup starts from scratch."""
+        for step in self.resources('checkpoint'):
+            self.forget('checkpoint', step)
+
+    #
+
+    #
+    def _append(self, op, resource_type, name, resource_id, data):
+        event = {'ts': time.time(), 'op': op, 'type': resource_type, 'name': name}
+        if resource_id is not None:
+            event['id'] = resource_id
+        if data:
+            event['data'] = data
+
+        self.logger.debug("Journal (%s): %s %s '%s'", self.path, op, resource_type, name)
+        with self._lock:
+            state = self._current_state()
+            with open(self.path, 'a') as journal_stream:
+                journal_stream.write(json.dumps(event) + "\n")
+                journal_stream.flush()
+                os.fsync(journal_stream.fileno())
+            _apply_event(state, event)
+            self._file_id = self._stat_file()
+
+    #
+
+    #
+    def _current_state(self):
+        # called with the lock held
+        file_id = self._stat_file()
+        if self._state is None or file_id != self._file_id:
+            state = {}
+            for event in self._events():
+                _apply_event(state, event)
+            self._state = state
+            self._file_id = file_id
+        return self._state
+
+    #
+
+    #
+    def _stat_file(self):
+        try:
+            file_stat = os.stat(self.path)
+        except OSError:
+            return None
+        return file_stat.st_ino, file_stat.st_size
+
+    #
+
+    #
+    def _events(self):
+        if not self.exists():
+            return
+
+        with open(self.path, 'r') as journal_stream:
+            for line in journal_stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # a torn last line (crash while writing) is skipped
+                    self.logger.warn("Skipping corrupt line in journal '%s'", self.path)
+
+
+def _apply_event(state, event):
+    entries = state.setdefault(event['type'], OrderedDict())
+    name = event['name']
+    if event['op'] == 'add':
+        entries[name] = {'id': event.get('id'), 'data': dict(event.get('data', {}))}
+    elif event['op'] == 'update' and name in entries:
+        entries[name]['data'].update(event.get('data', {}))
+    elif event['op'] == 'remove':
+        entries.pop(name, None)
+
+
+def _copy_entry(entry):
+    return {'id': entry['id'], 'data': dict(entry['data'])}
@@ -0,0 +1,177 @@
+import logging
+import sys
+import telemetry
+import threading
+import time
+import utils
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+# Python 2 doesn't deliver Ctrl-C to a thread blocked in Condition.wait() without a timeout
+_WAIT_SECONDS = 1.0
+
+
+#
+class TaskGraph:
+    """
+    A small executor for a DAG of tasks.
+
+    Every task starts as soon as all of its dependencies finished, on a pool of max_workers threads. When a task fails,
+    no new task is started; the running ones are waited for and the first error is re-raised by `run`.
+    """
+
+    #
+    def __init__(self, max_workers=8):
+        self.logger = logging.getLogger(__name__)
+        self.max_workers = max_workers
+        self.tasks = OrderedDict()
+        self.results = {}
+        self.timings = {}
+
+        self._cond = threading.Condition()
+        self._done = set()
+        self._errors = []
+
+    #
+
+    #
+    def add(self, name, fn, deps=None):
+        """Adds a task. fn is called without arguments, its return value is available via `result(name)`."""
+        if name in self.tasks:
+            raise ValueError("Task '%s' already added" % name)
+        self.tasks[name] = {'fn': fn, 'deps': list(deps or [])}
+
+    #
+
+    #
+    def result(self, name):
+        return self.results.get(name)
+
+    #
+
+    #
+    def run(self):
+        """Runs all tasks. Raises the error of the first failed task (if any)."""
+        for name, task in self.tasks.items():
+            missing = [dep for dep in task['deps'] if dep not in self.tasks]
+            if missing:
+                raise ValueError("Task '%s' depends on unknown tasks: %s" % (name, missing))
+
+        self._start_time = time.time()
+        # the log context of the caller (project, request, ...) applies to the tasks as well
+        self._context = telemetry.get_thread_context()
+        pending = OrderedDict(self.tasks)
+        running = set()
+
+        pool = ThreadPool(max(1, min(self.max_workers, len(self.tasks))))
+        try:
+            with self._cond:
+                while pending or running:
+                    running -= self._done
+                    if not self._errors:
+                        ready = [name for name, task in pending.items()
+                                 if all(dep in self._done for dep in task['deps'])]
+                        for name in ready:
+                            del pending[name]
+                            running.add(name)
+                            pool.apply_async(self._execute, (name,))
+
+                    if self._errors and not running:
+                        break
+                    if not running and pending:
+                        raise ValueError("Dependency cycle between tasks: %s" % list(pending))
+                    if running:
+                        self._cond.wait(_WAIT_SECONDS)
+                        running -= self._done
+        finally:
+            pool.close()
+            pool.join()
+
+        if self._errors:
+            name, exc_info = self._errors[0]
+            self.logger.error("Task '%s' failed, %s tasks not started", name, len(pending), exc_info=exc_info)
+            utils.reraise(exc_info)
+
+        self.log_critical_path()
+
+    #
+
+    #
+    def simulate(self, durations):
+        """
+        Predicts the wall time of `run` from the durations of the tasks, without running anything: the tasks are
+        scheduled the same way, as soon as their dependencies are done and a worker is free.
+
+        :param durations: task name -> seconds
+        :return: the predicted wall time in seconds
+        """
+        finished = set()
+        running = []
+        pending = OrderedDict(self.tasks)
+        now = 0.0
+        while pending or running:
+            ready = [name for name, task in pending.items() if all(dep in finished for dep in task['deps'])]
+            for name in ready[:self.max_workers - len(running)]:
+                del pending[name]
+                running.append((now + durations.get(name, 0.0), name))
+            if not running:
+                raise ValueError("Dependency cycle between tasks: %s" % list(pending))
+
+            running.sort()
+            now, name = running.pop(0)
+            finished.add(name)
+
+        return now
+
+    #
+
+    #
+    def critical_path(self):
+        """
+        :return: the chain of tasks that determined the wall time of the run, as (name, duration) pairs
+        :rtype: list
+        """
+        if not self.timings:
+            return []
+
+        path = []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        while name:
+            start, end = self.timings[name]
+            path.append((name, end - start))
+            deps = [dep for dep in self.tasks[name]['deps'] if dep in self.timings]
+            name = max(deps, key=lambda n: self.timings[n][1]) if deps else None
+
+        path.reverse()
+        return path
+
+    #
+
+    #
+    def log_critical_path(self):
+        path = self.critical_path()
+        if not path:
+            return
+
+        wall_time = max(end for _, end in self.timings.values()) - self._start_time
+        self.logger.info("Ran %s tasks in %.1f seconds, critical path: %s", len(self.timings), wall_time,
+                         " -> ".join("%s (%.1fs)" % (name, duration) for name, duration in path))
+
+    #
+
+    #
+    def _execute(self, name):
+        start = time.time()
+        try:
+            with telemetry.log_context(**self._context):
+                self.results[name] = self.tasks[name]['fn']()
+        except BaseException:
+            # SystemExit (exit(1) in the driver) as well, it must not kill the worker thread silently
+            with self._cond:
+                self._errors.append((name, sys.exc_info()))
+        finally:
+            with self._cond:
+                self.timings[name] = (start, time.time())
+                self._done.add(name)
+                self._cond.notify()
@@ -0,0 +1,401 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import types
+
+from contextlib import contextmanager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# ---------------------------------------------------------------------------------------------------------------- #
+# ### Logging ###
+# ---------------------------------------------------------------------------------------------------------------- #
+
+# project/action are process-wide, anything else (e.g. host) is per thread
+_global_context = {'project': None, 'action': None}
+_thread_context = threading.local()
+
+
+def set_context(**kwargs):
+    _global_context.update(kwargs)
+
+
+@contextmanager
+def log_context(**kwargs):
+    """Adds fields (e.g. host=...) to the log records emitted by the current thread."""
+    previous = dict(getattr(_thread_context, 'fields', {}))
+    _thread_context.fields = dict(previous, **kwargs)
+    try:
+        yield
+    finally:
+        _thread_context.fields = previous
+
+
+def get_context():
+    context = dict(_global_context)
+    context.update(getattr(_thread_context, 'fields', {}))
+    return context
+
+
+def get_thread_context():
+    """The fields of the current thread only, to carry them over to worker threads (see `log_context`)."""
+    return dict(getattr(_thread_context, 'fields', {}))
+
+
+#
+class ContextFilter(logging.Filter):
+    """Stamps project, action, host and (daemon) request context on every record (in the emitting thread)."""
+
+    def filter(self, record):
+        context = get_context()
+        for key in ('project', 'action', 'host', 'request'):
+            setattr(record, key, context.get(key))
+        return True
+
+
+#
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + ".%03dZ" % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key in ('project', 'action', 'host', 'request'):
+            if getattr(record, key, None):
+                entry[key] = getattr(record, key)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry)
+
+
+#
+class QueueHandler(logging.Handler):
+    """Puts the records on a queue, the (slow) handlers run on the listener's thread."""
+
+    def __init__(self, record_queue):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+
+    def emit(self, record):
+        try:
+            # resolve everything that may change (or not be serializable) once the record leaves this thread
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+#
+class _FlushMarker:
+    def __init__(self):
+        self.handled = threading.Event()
+
+
+#
+class QueueListener:
+    def __init__(self, record_queue, handlers):
+        self.queue = record_queue
+        self.handlers = handlers
+        self._thread = threading.Thread(target=self._monitor, name='log-listener')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def add_handler(self, handler):
+        # copy on write, the listener thread iterates over the list without locking
+        self.handlers = self.handlers + [handler]
+
+    def remove_handler(self, handler):
+        self.handlers = [h for h in self.handlers if h is not handler]
+
+    def flush(self, timeout=10):
+        """Waits until the records enqueued so far are handled."""
+        if self._thread.is_alive():
+            marker = _FlushMarker()
+            self.queue.put(marker)
+            marker.handled.wait(timeout)
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+        for handler in self.handlers:
+            handler.close()
+
+    def _monitor(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            if isinstance(record, _FlushMarker):
+                record.handled.set()
+                continue
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+_listener = None
+
+
+def setup_logging(level, log_file=None, json_lines=True):
+    """
+    Sets up non-blocking logging: the root logger only enqueues the records, a listener thread writes them to stderr
+    (plain text) and to log_file (JSON lines, or plain text if json_lines is False).
+    """
+    global _listener
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(level)
+    console_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    handlers = [console_handler]
+
+    if log_file:
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setLevel(level)
+        if json_lines:
+            file_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(file_handler)
+
+    record_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(record_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(record_queue, handlers)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def add_log_handler(handler):
+    """Adds a handler to the listener of `setup_logging` (e.g. one that streams records to a daemon client)."""
+    _listener.add_handler(handler)
+
+
+def remove_log_handler(handler):
+    _listener.flush()
+    _listener.remove_handler(handler)
+
+
+# ---------------------------------------------------------------------------------------------------------------- #
+# ### Metrics ###
+# ---------------------------------------------------------------------------------------------------------------- #
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+#
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, prefix='lusheeta_'):
+        self.prefix = prefix
+        self.const_labels = {}
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    #
+
+    #
+    def inc(self, name, value=1, help_text=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            if help_text:
+                self._help[name] = help_text
+
+    #
+
+    #
+    def observe(self, name, value, help_text=None, buckets=DEFAULT_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if not histogram:
+                histogram = self._histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets),
+                                                     'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+            if help_text:
+                self._help[name] = help_text
+
+    #
+
+    #
+    @contextmanager
+    def timer(self, name, help_text=None, **labels):
+        """Observes the duration of the block in seconds (also when it raises)."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time, help_text=help_text, **labels)
+
+    #
+
+    #
+    def histograms(self):
+        """
+        :return: (name, labels) -> (sum, count) of every histogram, labels is a sorted tuple of (label, value) pairs
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(((name, labels), (h['sum'], h['count']))
+                        for (name, labels), h in self._histograms.items())
+
+    #
+
+    #
+    def render(self):
+        lines = []
+        with self._lock:
+            for name in sorted(set(n for n, _ in self._counters)):
+                full_name = self.prefix + name
+                if name in self._help:
+                    lines.append("# HELP %s %s" % (full_name, self._help[name]))
+                lines.append("# TYPE %s counter" % full_name)
+                for (n, labels), value in sorted(self._counters.items()):
+                    if n == name:
+                        lines.append("%s%s %s" % (full_name, self._labels(labels), value))
+
+            for name in sorted(set(n for n, _ in self._histograms)):
+                full_name = self.prefix + name
+                if name in self._help:
+                    lines.append("# HELP %s %s" % (full_name, self._help[name]))
+                lines.append("# TYPE %s histogram" % full_name)
+                for (n, labels), histogram in sorted(self._histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(histogram['buckets'], histogram['counts']):
+                        lines.append("%s_bucket%s %s" % (full_name, self._labels(labels, le=repr(float(bound))),
+                                                         count))
+                    lines.append("%s_bucket%s %s" % (full_name, self._labels(labels, le='+Inf'), histogram['count']))
+                    lines.append("%s_sum%s %s" % (full_name, self._labels(labels), histogram['sum']))
+                    lines.append("%s_count%s %s" % (full_name, self._labels(labels), histogram['count']))
+
+        return "\n".join(lines) + "\n"
+
+    #
+
+    #
+    def write_textfile(self, path):
+        """Writes the metrics atomically (for the node_exporter textfile collector)."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as metrics_stream:
+            metrics_stream.write(self.render())
+        os.rename(tmp_path, path)
+
+    #
+
+    #
+    def _labels(self, labels, **extra):
+        all_labels = dict(self.const_labels)
+        all_labels.update(labels)
+        all_labels.update(extra)
+        if not all_labels:
+            return ""
+        return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for k, v in sorted(all_labels.items()))
+
+
+#
+class _ScopedMetrics:
+    """
+    The `metrics` of the module: forwards to the registry of the current scope (see `metrics_scope`), e.g. of the
+    action a daemon request runs, and to the registry of the process outside of any scope.
+    """
+
+    def __getattr__(self, name):
+        return getattr(current_metrics(), name)
+
+    def __setattr__(self, name, value):
+        setattr(current_metrics(), name, value)
+
+
+_process_metrics = MetricsRegistry()
+metrics = _ScopedMetrics()
+
+
+def current_metrics():
+    """:return: the registry of the current scope (see `metrics_scope`), the registry of the process if there is none"""
+    return getattr(_thread_context, 'fields', {}).get('metrics') or _process_metrics
+
+
+@contextmanager
+def metrics_scope(registry):
+    """
+    Sends the metrics of the current thread to registry. Like the log context, the scope is carried into the
+    workers the thread starts (TaskGraph, run_concurrently).
+    """
+    with log_context(metrics=registry):
+        yield registry
+
+
+#
+class InstrumentedApi:
+    """
+    Wraps an SDK proxy (e.g. connection.compute) and measures every call: latency histogram and error counter.
+    Listings return generators, those are measured until exhausted.
+    """
+
+    def __init__(self, api, api_name, registry=None):
+        self._api = api
+        self._api_name = api_name
+        self._registry = registry or metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            start_time = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                self._record(name, start_time, error=True)
+                raise
+            if isinstance(result, types.GeneratorType):
+                return self._measure_generator(name, start_time, result)
+            self._record(name, start_time)
+            return result
+
+        return call
+
+    def _measure_generator(self, name, start_time, generator):
+        try:
+            for item in generator:
+                yield item
+        except Exception:
+            self._record(name, start_time, error=True)
+            raise
+        self._record(name, start_time)
+
+    def _record(self, name, start_time, error=False):
+        self._registry.observe('api_call_seconds', time.time() - start_time,
+                               help_text="Latency of cloud API calls", api=self._api_name, call=name)
+        if error:
+            self._registry.inc('api_call_errors_total', help_text="Failed cloud API calls",
+                               api=self._api_name, call=name)
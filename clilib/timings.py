@@ -0,0 +1,92 @@
+#
+# https://github.com/sperka/lusheeta
+#
+
+import glob
+import json
+import logging
+import os
+
+TIMINGS_FILE = 'timings.json'
+
+
+def series_key(name, labels):
+    return "%s{%s}" % (name, ",".join("%s=%s" % (k, v) for k, v in sorted(labels.items())))
+
+
+#
+class TimingHistory:
+    """
+    The durations observed by the runs of a project (the histograms of the metrics registry: API calls, VM boots,
+    floating IP operations, playbook runs), accumulated in <project_path>/timings.json as sum and count per series.
+    """
+
+    #
+    def __init__(self, series=None):
+        self.logger = logging.getLogger(__name__)
+        # series key -> {'sum': .., 'count': ..}
+        self.series = series or {}
+
+    #
+
+    #
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return TimingHistory()
+        with open(path, 'r') as timings_stream:
+            return TimingHistory(json.load(timings_stream))
+
+    #
+
+    #
+    @staticmethod
+    def load_all(projects_dir):
+        """:return: the timings of all the projects in projects_dir merged"""
+        history = TimingHistory()
+        for path in glob.glob(os.path.join(projects_dir, '*', TIMINGS_FILE)):
+            history.merge(TimingHistory.load(path).series)
+        return history
+
+    #
+
+    #
+    def merge(self, series):
+        for key, stats in series.items():
+            merged = self.series.setdefault(key, {'sum': 0.0, 'count': 0})
+            merged['sum'] += stats['sum']
+            merged['count'] += stats['count']
+
+    #
+
+    #
+    def merge_histograms(self, histograms):
+        """Adds the histograms of a metrics registry ((name, labels) -> (sum, count))."""
+        for (name, labels), (total, count) in histograms.items():
+            if count:
+                self.merge({series_key(name, dict(labels)): {'sum': total, 'count': count}})
+
+    #
+
+    #
+    def mean(self, name, **labels):
+        """:return: the mean duration of the series, None if it was never observed"""
+        stats = self.series.get(series_key(name, labels))
+        if not stats or not stats['count']:
+            return None
+        return stats['sum'] / stats['count']
+
+    #
+
+    #
+    def samples(self):
+        return sum(stats['count'] for stats in self.series.values())
+
+    #
+
+    #
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as timings_stream:
+            json.dump(self.series, timings_stream, indent=2, sort_keys=True)
+        os.rename(tmp_path, path)
@@ -1,7 +1,13 @@
+import calendar
 import logging
 import os
+import sys
+import telemetry
+import time
 import yaml
 
+from multiprocessing.pool import ThreadPool
+
 
 def load_yaml_config(cfg_file):
     if not isinstance(cfg_file, basestring):
@@ -42,6 +48,15 @@ def save_string_to_file(str, target_path, chmod=None):
         os.chmod(target_path, chmod)
 
 
+# Python 2's re.escape escapes every non-alphanumeric character (e.g. '_' and '-'), the server side regex engines
+# of the name filters don't know these escapes
+_REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def regex_escape(text):
+    return ''.join('\\' + char if char in _REGEX_METACHARACTERS else char for char in text)
+
+
 def static_vars(**kwargs):
     def decorate(func):
         for k in kwargs:
@@ -50,6 +65,58 @@ def static_vars(**kwargs):
     return decorate
 
 
+if sys.version_info[0] == 2:
+    # the three-argument raise is a syntax error for Python 3
+    exec("def reraise(exc_info):\n"
+         "    \"\"\"Re-raises the exception of exc_info (sys.exc_info() of another thread) with its traceback.\"\"\"\n"
+         "    raise exc_info[0], exc_info[1], exc_info[2]\n")
+else:
+    def reraise(exc_info):
+        """Re-raises the exception of exc_info (sys.exc_info() of another thread) with its traceback."""
+        raise exc_info[1].with_traceback(exc_info[2])
+
+
+def run_concurrently(fn, items, max_workers=8):
+    """
+    Calls fn for every item on a thread pool and returns the results in the order of the items.
+    If any call raised (SystemExit included), the first error is re-raised once all calls finished.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    context = telemetry.get_thread_context()
+
+    def _call(item):
+        try:
+            with telemetry.log_context(**context):
+                return True, fn(item)
+        except BaseException:
+            return False, sys.exc_info()
+
+    pool = ThreadPool(max(1, min(max_workers, len(items))))
+    try:
+        results = pool.map(_call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    for ok, value in results:
+        if not ok:
+            reraise(value)
+    return [value for _, value in results]
+
+
+def parse_timestamp(value):
+    """Parses an OpenStack (UTC, ISO 8601) timestamp, e.g. '2016-05-04T10:20:30Z', into epoch seconds."""
+    if not value:
+        return None
+    try:
+        return calendar.timegm(time.strptime(value[:19], '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        return None
+
+
 VERBOSE_LOGGING_LEVEL = {
     0: logging.ERROR,
     1: logging.WARN,
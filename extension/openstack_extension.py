@@ -1,39 +1,103 @@
+import base64
 import logging
 import os
+import re
 import stat
+import clilib.telemetry as telemetry
 import clilib.utils as utils
+import threading
 import time
+import uuid
 
-from openstack import connection
+from clilib.ansible_mgr import AnsibleManager
+from clilib.state_journal import StateJournal
+from clilib.task_graph import TaskGraph
+from collections import namedtuple
+from openstack import connection, resource
+from openstack.compute.v2 import server as sdk_server
+
+# compact representation of a cloud node (same attributes the AnsibleManager reads from SDK servers)
+NodeRecord = namedtuple('NodeRecord', ['name', 'id', 'status', 'addresses'])
+
+# naming conventions of the driver (see OpenStackDriver.__init__), used to map tenant resources back to projects
+_PROJECT_RESOURCE_PATTERNS = [
+    ('router_port', re.compile(r'^([^\W_]+)_network_router_port$')),
+    ('router', re.compile(r'^([^\W_]+)_network_router$')),
+    ('subnet', re.compile(r'^([^\W_]+)_network_subnet$')),
+    ('network', re.compile(r'^([^\W_]+)_network$')),
+    ('security_group', re.compile(r'^([^\W_]+)_secgroup$')),
+    ('keypair', re.compile(r'^([^\W_]+)_ssh$')),
+    ('server', re.compile(r'^([^\W_]+)-')),
+    ('floating_ip', re.compile(r'^Floating IP for ([^\W_]+)-'))
+]
+
+# only these make a project, the other resources are attached to the projects found by them
+_PROJECT_ANCHOR_RESOURCES = ['network', 'security_group']
+
+# a project is complete if it has all of these (and at least one server)
+_PROJECT_CORE_RESOURCES = ['network', 'subnet', 'router', 'security_group', 'keypair']
+
+# ports created by one bulk request (vm_management.precreate_ports)
+_PORTS_PER_BULK_REQUEST = 100
+
+# plan estimates of the calls never timed before (seconds)
+_DEFAULT_CALL_SECONDS = {'wait_for_server': 60.0}
+_FALLBACK_CALL_SECONDS = 0.5
+
+
+class _MultiCreateServer(sdk_server.Server):
+    # os-multiple-create: the Server of the SDK drops these, Nova would boot a single instance
+    min_count = resource.Body('min_count', type=int)
+    max_count = resource.Body('max_count', type=int)
 
 
 class OpenStackDriver:
-    cloud_images_dict = None
-    flavors_dict = None
-    ip_pools = None
-    proj_network_cached = None
-    ext_net_cached = None
+    # the drivers of the regions share the project's ssh key, only one of them may create it
+    _key_pair_lock = threading.Lock()
 
-    def __init__(self, config, project_name):
+    def __init__(self, config, project_name, region=None, cassette=None):
+        """
+        :param region: the region this driver manages. None means the `region_name` of the platform settings file.
+                       A region of another cloud must be listed in `config.regions` with its own `settings_file`.
+        :param cassette: records the network/compute API traffic, or replays it instead of connecting to the cloud
+        :type cassette: :class:`clilib.cassette.Cassette`
+        """
         self.logger = logging.getLogger(__name__)
 
         self.config = config
         self.project_name = project_name
+        self.resume = False
+
+        # per region (connection) caches
+        self.cloud_images_dict = None
+        self.flavors_dict = None
+        self.proj_network_cached = None
+        self.ext_net_cached = None
+        self._ansible_mgr = None
 
         self.logger.debug("Loading openstack yaml config '%s'", config['platform_settings']['settings_file'])
         openstack_settings = utils.load_yaml_config(config['platform_settings']['settings_file'])
+        self.default_region_name = openstack_settings.get('region_name')
+        self.region_name = region or self.default_region_name
+
+        region_settings = config['regions'].get(self.region_name) or {}
+        if region_settings.get('settings_file'):
+            self.logger.debug("Loading openstack yaml config '%s' for region '%s'", region_settings['settings_file'],
+                              self.region_name)
+            openstack_settings = utils.load_yaml_config(region_settings['settings_file'])
 
         auth_args = {
             'auth_url': openstack_settings['auth_url_base'],
             'project_name': openstack_settings['project_name'],
             'username': openstack_settings['username'],
-            'password': openstack_settings['password']
+            'password': openstack_settings['password'],
+            'region_name': region_settings.get('region_name', self.region_name)
         }
-        conn = connection.Connection(**auth_args)
-        self.network_api = conn.network
-        self.compute_api = conn.compute
-        self.cluster_api = conn.cluster
-        self.identity_api = conn.identity
+        self.cassette = cassette
+        # connected at the first API call (see `connection`), the offline actions never authenticate
+        self._auth_args = auth_args
+        self._connection = None
+        self._connection_lock = threading.Lock()
 
         # setup vars
         self._ssh_key = self.project_name + "_ssh"
@@ -44,38 +108,192 @@ class OpenStackDriver:
         self._router_port_name = self._router_name + "_port"
         self._sec_group_name = self.project_name + "_secgroup"
 
-    def create_cluster(self):
+        # IDs of everything created for the project, used by ID-based cleanup and offline ansible preparation
+        self.journal = StateJournal(config['project_path'], StateJournal.file_name_for_region(
+            None if self.region_name == self.default_region_name else self.region_name))
+
+    @property
+    def connection(self):
+        self._connect()
+        return self._connection
+
+    @property
+    def network_api(self):
+        self._connect()
+        return self._network_api
+
+    @property
+    def compute_api(self):
+        self._connect()
+        return self._compute_api
+
+    @property
+    def cluster_api(self):
+        return self.connection.cluster
+
+    @property
+    def identity_api(self):
+        return self.connection.identity
+
+    def _connect(self):
+        """
+        Opens the connection of the region at the first API call: the SDK authenticates and discovers the endpoints
+        when a proxy is first read, which `plan` and `prepare_ansible --offline` must not do.
+        """
+        with self._connection_lock:
+            if self._connection is not None:
+                return
+            if self.cassette:
+                conn = self.cassette.wrap_connection(lambda: connection.Connection(**self._auth_args),
+                                                     self.region_name)
+            else:
+                conn = connection.Connection(**self._auth_args)
+            self._network_api = telemetry.InstrumentedApi(conn.network, 'network')
+            self._compute_api = telemetry.InstrumentedApi(conn.compute, 'compute')
+            self._connection = conn
+
+    def create_cluster(self, resume=False):
         """
         Creates the cluster on the OpenStack cloud.
 
+        The steps run as a task graph, each one as soon as its own inputs are ready:
+
+        0. Look up images, flavors, default security group and ext-net
         1. Create security group with default rules
         2. Create network, subnet, router, set router gateway to ext-net, add router interface (router - subnet)
         3. Create ssh key-pair in the cloud, then download
-        4. Create VMs
-        5. Create floating IPs and associate them
-        6. Import ssh key-pair to bastion if exists
+        (3b. with vm_management.precreate_ports: create the ports of all VMs in bulk, with the security groups set)
+        4. Create VMs (each one waits for 0-3 only; with vm_management.multi_create the VMs of a homogeneous host
+           group are requested at once, then renamed)
+        5. Create floating IPs and associate them (each one waits for its own VM only)
+
+        Every completed step is checkpointed in the state journal. With resume=True, the checkpointed steps whose
+        resources still exist are skipped, the partially done ones are rolled back and redone.
         """
-        # TODO: check available resources
-        # self.check_available_resources()
+        self.resume = resume
+        if resume:
+            self.logger.info("Resuming cluster creation for project '%s'...", self.project_name)
+        else:
+            self.logger.info("Creating new cluster for project '%s'...", self.project_name)
 
-        # TEMP
-        # self.cleanup_cluster()
+        if self.config['vm_management']['check_resources']:
+            shortfalls = self.check_available_resources()
+            if shortfalls:
+                self.logger.error("Not enough resources for project '%s'. Cluster creation doesn't continue. "
+                                  "Quitting...", self.project_name)
+                exit(1)
 
-        self.logger.info("Creating new cluster for project '%s'...", self.project_name)
+        graph = TaskGraph(max_workers=self.config['vm_management']['max_parallel'])
+        graph.add('lookup', self.lookup_cloud_resources)
+        graph.add('security_group', self._resumable('security_group', self.create_security_group,
+                                                    verify_fn=self._verify_security_group,
+                                                    rollback_fn=self.cleanup_security_group_by_id))
+        graph.add('network', self._resumable('network', self.create_network,
+                                             verify_fn=self._verify_network,
+                                             rollback_fn=self.cleanup_network_by_id))
+        graph.add('keypair', self._resumable('keypair', self.create_ssh_key_pair,
+                                             verify_fn=self._verify_ssh_key_pair,
+                                             rollback_fn=self._rollback_ssh_key_pair))
+        if self.config['vm_management']['precreate_ports']:
+            graph.add('ports', lambda: self.create_ports(graph.result('network'),
+                                                         [graph.result('lookup'), graph.result('security_group')]),
+                      deps=['lookup', 'security_group', 'network'])
+        self.create_vms(graph)
+
+        graph.run()
 
-        self.create_security_group()
-        self.create_network()
-        self.create_ssh_key_pair()
-        self.create_vms()
+        self.logger.info("Cluster setup for project '%s' complete...", self.project_name)
 
-        self.process_cloud_vars()
+    def _resumable(self, step, run_fn, verify_fn, rollback_fn, host_name=None):
+        """
+        Wraps a step of create_cluster so that it's checkpointed when done.
 
-        self.logger.info("Cluster setup for project '%s' complete...", self.project_name)
+        When resuming, a checkpointed step is skipped if verify_fn finds its resource (which is then the result of the
+        step). Otherwise rollback_fn removes whatever the step had created before it's run again.
+        """
+        def task():
+            with telemetry.log_context(host=host_name):
+                return run_step()
+
+        def run_step():
+            if self.resume:
+                if self.journal.is_checkpointed(step):
+                    resource = verify_fn()
+                    if resource:
+                        self.logger.info("Step '%s' already done, skipping...", step)
+                        return resource
+                    self.logger.warn("Step '%s' was done but its resources are gone. Redoing...", step)
+                    self.journal.forget('checkpoint', step)
+                rollback_fn()
+
+            result = run_fn()
+            self.journal.checkpoint(step)
+            return result
+
+        return task
+
+    def _verify_security_group(self):
+        sg = self.journal.get('security_group', self._sec_group_name)
+        return sg and self.network_api.find_security_group(sg['id'])
+
+    def _verify_network(self):
+        network = self.journal.get('network', self._network_name)
+        router = self.journal.get('router', self._router_name)
+        if not network or not router or not self.network_api.find_router(router['id']):
+            return None
+        return self.network_api.find_network(network['id'])
+
+    def _verify_ssh_key_pair(self):
+        project_path = os.path.join(self.config['projects_dir'], self.config['project'])
+        if not os.path.exists(os.path.join(project_path, self._ssh_key)):
+            return None
+        return self.compute_api.find_keypair(self._ssh_key)
+
+    def _rollback_ssh_key_pair(self):
+        if self.journal.get('keypair', self._ssh_key):
+            self.compute_api.delete_keypair(self._ssh_key, ignore_missing=True)
+            self.journal.forget('keypair', self._ssh_key)
+
+    def _verify_server(self, host_name):
+        server = self.journal.get('server', host_name)
+        node = server and self.compute_api.find_server(server['id'])
+        return node if node and node.status == 'ACTIVE' else None
+
+    def _rollback_server(self, host_name):
+        server = self.journal.get('server', host_name)
+        if not server:
+            return
+
+        self.logger.info("Deleting unfinished VM: %s", host_name)
+        self.compute_api.delete_server(server['id'], ignore_missing=True)
+        timeout = time.time() + self.config['vm_management']['hosts_startup_timeout']
+        while self.compute_api.find_server(server['id']):
+            if time.time() >= timeout:
+                # kept in the journal, a later resume or cleanup deletes it
+                self.logger.error("Unfinished VM %s wasn't deleted in %s seconds. Quitting...", host_name,
+                                  self.config['vm_management']['hosts_startup_timeout'])
+                exit(1)
+            self._sleep_poll()
+        self.journal.forget('server', host_name)
+
+    def _verify_floating_ip(self, host_name):
+        fip = self.journal.get('floating_ip', host_name)
+        floating_ip = fip and self.network_api.find_ip(fip['id'])
+        return floating_ip if floating_ip and floating_ip.port_id else None
+
+    def _rollback_floating_ip(self, host_name):
+        fip = self.journal.get('floating_ip', host_name)
+        if fip:
+            self.network_api.delete_ip(fip['id'], ignore_missing=True)
+            self.journal.forget('floating_ip', host_name)
 
     def cleanup_cluster(self):
         """
         Cleans up a cluster on the OpenStack cloud.
 
+        If the project's state journal records resources, they are deleted by ID (see `cleanup_cluster_by_id`).
+        Otherwise (no journal, or an empty one) the resources are looked up by name:
+
         1. Disassociate floating ips
         2. Terminate VMs
         3. Cleanup ssh key-pair
@@ -85,6 +303,10 @@ class OpenStackDriver:
 
         :return:
         """
+        if not self.journal.is_empty():
+            self.cleanup_cluster_by_id()
+            return
+
         self.logger.info("Cleaning up cluster for project '%s'", self.project_name)
 
         self.disassociate_floating_ips()
@@ -92,11 +314,590 @@ class OpenStackDriver:
         self.cleanup_ssh_key_pair()
         self.cleanup_network()
         self.cleanup_security_group()
+        self.journal.clear_checkpoints()
 
         self.logger.info("Cluster cleanup for project '%s' complete...", self.project_name)
 
+    def cleanup_cluster_by_id(self):
+        """
+        Cleans up a cluster using the IDs recorded in the project's state journal, without listing the tenant.
+
+        1. Delete floating ips (deleting also disassociates them)
+        2. Terminate VMs and wait for them to disappear, delete their pre-created ports
+        3. Cleanup ssh key-pair
+        4. Detach subnet from router, delete router, subnet and network
+        5. Cleanup security group (its rules are deleted along with it)
+        """
+        self.logger.info("Cleaning up cluster for project '%s' using state journal '%s'", self.project_name,
+                         self.journal.path)
+
+        # 1
+        for name, fip in self.journal.resources('floating_ip').items():
+            self.logger.info("Deleting floating ip '%s' of node '%s'", fip['data'].get('address'), name)
+            with telemetry.metrics.timer('floating_ip_seconds', op='delete'):
+                self.network_api.delete_ip(fip['id'], ignore_missing=True)
+            telemetry.metrics.inc('floating_ips_total', op='delete')
+            self.journal.forget('floating_ip', name)
+
+        # 2
+        servers = self.journal.resources('server')
+        for name, server in servers.items():
+            self.logger.info("Terminating VM: %s", name)
+            self.compute_api.delete_server(server['id'], ignore_missing=True)
+
+        self.logger.debug("Waiting for nodes to terminate...")
+        remaining = servers
+        while remaining:
+            self._sleep_poll()
+            still_running = dict((name, server) for name, server in remaining.items()
+                                 if self.compute_api.find_server(server['id']))
+            for name in remaining:
+                if name not in still_running:
+                    self.journal.forget('server', name)
+            remaining = still_running
+        self.logger.debug("All nodes terminated...")
+
+        # the pre-created ports (vm_management.precreate_ports) outlive their servers
+        for name, port in self.journal.resources('port').items():
+            self.logger.info("Deleting port of node '%s'", name)
+            self.network_api.delete_port(port['id'], ignore_missing=True)
+            self.journal.forget('port', name)
+
+        # 3
+        for name, key_pair in self.journal.resources('keypair').items():
+            self.logger.info("Cleaning up ssh key pair %s", name)
+            self.compute_api.delete_keypair(key_pair['id'], ignore_missing=True)
+            self.journal.forget('keypair', name)
+
+        # 4
+        self.cleanup_network_by_id()
+
+        # 5
+        self.cleanup_security_group_by_id()
+
+        # a later create --resume has nothing to continue from
+        self.journal.clear_checkpoints()
+
+        self.logger.info("Cluster cleanup for project '%s' complete...", self.project_name)
+
+    def cleanup_network_by_id(self):
+        """Detaches the journaled subnet from the router, deletes the router, the subnet and the network."""
+        from openstack.exceptions import NotFoundException
+
+        routers = self.journal.resources('router')
+        subnets = self.journal.resources('subnet')
+        for name, port in self.journal.resources('router_port').items():
+            router = routers.get(port['data'].get('router'))
+            subnet = subnets.get(port['data'].get('subnet'))
+            if router and subnet:
+                try:
+                    self.network_api.remove_interface_from_router(router['id'], subnet['id'], port['id'])
+                except NotFoundException as e:
+                    self.logger.error("Problem with removing interface from router: %s", e)
+            self.journal.forget('router_port', name)
+
+        for name, router in routers.items():
+            self.logger.info("Deleting router '%s'", name)
+            self.network_api.delete_router(router['id'], ignore_missing=True)
+            self.journal.forget('router', name)
+
+        for name, subnet in subnets.items():
+            self.logger.info("Deleting subnet '%s'", name)
+            self.network_api.delete_subnet(subnet['id'], ignore_missing=True)
+            self.journal.forget('subnet', name)
+
+        for name, network in self.journal.resources('network').items():
+            self.logger.info("Deleting network '%s'", name)
+            self.network_api.delete_network(network['id'], ignore_missing=True)
+            self.journal.forget('network', name)
+
+        self.proj_network_cached = None
+
+    def cleanup_security_group_by_id(self):
+        """Deletes the journaled security group (its rules are deleted along with it)."""
+        for name, sg in self.journal.resources('security_group').items():
+            self.logger.info("Cleaning up security group '%s'", name)
+            self.network_api.delete_security_group(sg['id'], ignore_missing=True)
+            self.journal.forget('security_group', name)
+
+    def plan(self, action, history, resume=False):
+        """
+        Plans `create_cluster` (action 'create') or `cleanup_cluster` ('cleanup') from the hosts config and the state
+        journal, without calling the cloud.
+
+        :param history: the timings of earlier runs (:class:`clilib.timings.TimingHistory`), the API calls never seen
+                        are estimated with defaults
+        :return: {'ops': the operations in order (step, op, type, name, calls: list of (api, call), seconds),
+                  'graph': a task graph of the steps shaped like the one the action runs (see `TaskGraph.simulate`),
+                  'notes': list of warnings}
+        :rtype: dict
+        """
+        plan = {'ops': [], 'notes': []}
+        if action == 'create':
+            plan['graph'] = TaskGraph(max_workers=self.config['vm_management']['max_parallel'])
+            self._plan_create(plan, resume)
+        elif action == 'cleanup':
+            plan['graph'] = TaskGraph(max_workers=1)
+            self._plan_cleanup(plan)
+        else:
+            raise ValueError("Can't plan action '%s'" % action)
+
+        for op in plan['ops']:
+            op['seconds'] = op.pop('extra_seconds', 0.0) + sum(self._estimate_call(api, call, history)
+                                                               for api, call in op['calls'])
+        return plan
+
+    @staticmethod
+    def _estimate_call(api, call, history):
+        seconds = history.mean('api_call_seconds', api=api, call=call)
+        if seconds is None:
+            seconds = _DEFAULT_CALL_SECONDS.get(call, _FALLBACK_CALL_SECONDS)
+        return seconds
+
+    @staticmethod
+    def _plan_op(plan, step, op, resource_type, name, calls, deps=None, extra_seconds=0.0):
+        plan['ops'].append({'step': step, 'op': op, 'type': resource_type, 'name': name, 'calls': calls,
+                            'extra_seconds': extra_seconds})
+        plan['graph'].add(step, None, deps)
+
+    def _plan_create(self, plan, resume):
+        journal_exists = self.journal.exists()
+        if journal_exists and not resume:
+            plan['notes'].append("Project state exists in '%s': create without --resume backs it up and starts over "
+                                 "(the existing resources are not reused)" % self.journal.path)
+            journal_exists = False
+
+        def resumable(step, resource_type, name, calls, verify_calls, rollback_calls, deps):
+            if journal_exists and self.journal.is_checkpointed(step):
+                self._plan_op(plan, step, 'verify', resource_type, name, verify_calls, deps)
+            elif journal_exists and rollback_calls:
+                self._plan_op(plan, step, 'redo', resource_type, name, rollback_calls + calls, deps)
+            else:
+                self._plan_op(plan, step, 'create', resource_type, name, calls, deps)
+
+        def journaled(resource_type, name):
+            return journal_exists and self.journal.get(resource_type, name) is not None
+
+        base_deps = []
+        if self.config['vm_management']['check_resources']:
+            self._plan_op(plan, 'check', 'check', 'quota', "instances, cores, ram, network quota",
+                          [('compute', 'flavors'), ('compute', 'get_limits'), ('network', 'get_quota')])
+            base_deps = ['check']
+
+        lookup_calls = [('compute', 'images'), ('network', 'find_network'), ('network', 'security_groups')]
+        if not base_deps:
+            lookup_calls.insert(1, ('compute', 'flavors'))
+        self._plan_op(plan, 'lookup', 'lookup', 'resources', "images, flavors, ext-net, default security group",
+                      lookup_calls, base_deps)
+
+        rules = self.config['security_group']['rules']
+        resumable('security_group', 'security_group', "%s (%s rules)" % (self._sec_group_name, len(rules)),
+                  [('network', 'security_groups'), ('network', 'create_security_group')] +
+                  ([('network', 'create_security_group_rules')] if rules else []),
+                  [('network', 'find_security_group')],
+                  [('network', 'delete_security_group')] if journaled('security_group', self._sec_group_name) else [],
+                  base_deps)
+
+        network_calls = [('network', 'find_network')]
+        if self.config['network']['cidr'] == 'auto':
+            network_calls.append(('network', 'subnets'))
+        network_calls += [('network', 'create_network'), ('network', 'create_subnet'), ('network', 'create_router'),
+                          ('network', 'create_port'), ('network', 'add_interface_to_router')]
+        network_rollback = []
+        if journal_exists:
+            network_rollback = ([('network', 'remove_interface_from_router')] *
+                                len(self.journal.resources('router_port')) +
+                                [('network', 'delete_router')] * len(self.journal.resources('router')) +
+                                [('network', 'delete_subnet')] * len(self.journal.resources('subnet')) +
+                                [('network', 'delete_network')] * len(self.journal.resources('network')))
+        resumable('network', 'network', "%s, subnet, router" % self._network_name, network_calls,
+                  [('network', 'find_router'), ('network', 'find_network')], network_rollback, base_deps)
+
+        resumable('keypair', 'keypair', self._ssh_key,
+                  [('compute', 'find_keypair'), ('compute', 'create_keypair')],
+                  [('compute', 'find_keypair')],
+                  [('compute', 'delete_keypair')] if journaled('keypair', self._ssh_key) else [],
+                  base_deps)
+
+        server_deps = ['lookup', 'security_group', 'network', 'keypair']
+        precreate_ports = self.config['vm_management']['precreate_ports']
+        if precreate_ports:
+            host_names = [self.get_host_name(host, i) for host, i in self.iterate_nodes()]
+            # reused journaled ports are assumed to exist
+            missing = [name for name in host_names if not journaled('port', name)]
+            bulk_requests = (len(missing) + _PORTS_PER_BULK_REQUEST - 1) // _PORTS_PER_BULK_REQUEST
+            ports_name = "%s ports (%s reused)" % (len(missing), len(host_names) - len(missing))
+            self._plan_op(plan, 'ports', 'create' if missing else 'verify', 'port', ports_name,
+                          ([('network', 'ports')] if journal_exists else []) +
+                          [('network', 'create_ports')] * bulk_requests,
+                          ['lookup', 'security_group', 'network'])
+            server_deps.append('ports')
+
+        # a create without --resume starts over, the journal doesn't split the groups
+        multi_create_groups = self.get_multi_create_groups(ignore_journal=not journal_exists)
+        for host in self.config['hosts']:
+            indexes = multi_create_groups.get(host['name'])
+            if indexes:
+                self._plan_op(plan, 'servers:' + self.get_host_name_base(host), 'create', 'server',
+                              "%s x %s (multi-create)" % (self.get_host_name_base(host), len(indexes)),
+                              [('compute', '_create'), ('compute', 'get_server'), ('compute', 'servers')] +
+                              [('compute', 'update_server')] * len(indexes),
+                              server_deps)
+
+        for host, i in self.iterate_nodes():
+            host_name = self.get_host_name(host, i)
+            server_step = 'server:' + host_name
+            if host['name'] in multi_create_groups:
+                self._plan_op(plan, server_step, 'wait', 'server', host_name,
+                              [('compute', 'wait_for_server')] + [('compute', 'add_security_group_to_server')] * 2,
+                              ['servers:' + self.get_host_name_base(host)])
+            else:
+                resumable(server_step, 'server', host_name,
+                          [('compute', 'create_server'), ('compute', 'wait_for_server')] +
+                          ([] if precreate_ports else [('compute', 'add_security_group_to_server')] * 2),
+                          [('compute', 'find_server')],
+                          [('compute', 'delete_server'), ('compute', 'find_server')]
+                          if journaled('server', host_name) else [],
+                          server_deps)
+
+            if self.get_cloud_vars(host, i).get('assignPublicIP'):
+                resumable('floating_ip:' + host_name, 'floating_ip', host_name,
+                          [('network', 'create_ip'), ('compute', 'add_floating_ip_to_server')],
+                          [('network', 'find_ip')],
+                          [('network', 'delete_ip')] if journaled('floating_ip', host_name) else [],
+                          [server_step])
+
+    def _plan_cleanup(self, plan):
+        # the cleanup runs its steps one after the other
+        steps = []
+
+        def add(op, resource_type, name, calls, extra_seconds=0.0):
+            step = "%s:%s:%s" % (op, resource_type, name)
+            self._plan_op(plan, step, op, resource_type, name, calls, steps[-1:], extra_seconds)
+            steps.append(step)
+
+        poll = self.config['vm_management']['terminate_vm_poll']
+        if self.journal.is_empty():
+            plan['notes'].append("No resources in the state journal '%s': the resources are looked up by name, the "
+                                 "plan assumes all of them exist" % self.journal.path)
+            nodes = [(self.get_host_name(host, i), self.get_cloud_vars(host, i).get('assignPublicIP'))
+                     for host, i in self.iterate_nodes()]
+            add('delete', 'floating_ip', "%s floating ips" % sum(1 for _, public in nodes if public),
+                [('compute', 'servers'), ('network', 'ips')] +
+                [('compute', 'remove_floating_ip_from_server'), ('network', 'delete_ip')] *
+                sum(1 for _, public in nodes if public))
+            add('delete', 'server', "%s servers" % len(nodes),
+                [('compute', 'servers')] + [('compute', 'delete_server')] * len(nodes) + [('compute', 'servers')],
+                extra_seconds=poll)
+            add('delete', 'keypair', self._ssh_key, [('compute', 'find_keypair'), ('compute', 'delete_keypair')])
+            add('delete', 'network', "%s, subnet, router" % self._network_name,
+                [('network', 'find_router'), ('network', 'find_network'), ('network', 'ports'),
+                 ('network', 'remove_interface_from_router'), ('network', 'delete_router'),
+                 ('network', 'delete_subnet'), ('network', 'delete_network')])
+            add('delete', 'security_group', self._sec_group_name,
+                [('network', 'security_groups'), ('network', 'delete_security_group')])
+            return
+
+        for name in self.journal.resources('floating_ip'):
+            add('delete', 'floating_ip', name, [('network', 'delete_ip')])
+        servers = self.journal.resources('server')
+        for name in servers:
+            add('delete', 'server', name, [('compute', 'delete_server')])
+        if servers:
+            # at least one poll
+            add('wait', 'server', "%s servers" % len(servers), [('compute', 'find_server')] * len(servers),
+                extra_seconds=poll)
+        for name in self.journal.resources('port'):
+            add('delete', 'port', name, [('network', 'delete_port')])
+        for name in self.journal.resources('keypair'):
+            add('delete', 'keypair', name, [('compute', 'delete_keypair')])
+        for name in self.journal.resources('router_port'):
+            add('delete', 'router_port', name, [('network', 'remove_interface_from_router')])
+        for resource_type in ['router', 'subnet', 'network', 'security_group']:
+            for name in self.journal.resources(resource_type):
+                add('delete', resource_type, name, [('network', 'delete_' + resource_type)])
+
+    def garbage_collect(self, delete=False):
+        """
+        Finds (and with delete=True deletes) orphaned project resources in the whole tenant.
+
+        1. Take one snapshot of every resource type in the tenant
+        2. Index the resources by project using the naming conventions of the driver
+        3. Pick the orphans: incomplete resource sets older than `gc.min_age_hours`, and any resource set older than
+           `gc.stale_age_hours` (if set). A resource set without any timestamp is never picked, its age is unknown
+        4. Report, then (only with delete) delete the orphans concurrently in dependency order and remove them from
+           the state journals of their projects
+
+        :return: the orphaned projects' resources (project name -> resource type -> list of resources)
+        :rtype: dict
+        """
+        gc_settings = self.config['gc']
+
+        # 1, 2
+        snapshot = self.snapshot_tenant()
+        projects = self.index_project_resources(snapshot)
+
+        # 3
+        now = time.time()
+        min_age = gc_settings['min_age_hours'] * 3600
+        stale_age = gc_settings['stale_age_hours'] * 3600
+        orphans = {}
+        for project_name, resources in sorted(projects.items()):
+            complete = all(resources[t] for t in _PROJECT_CORE_RESOURCES) and resources['server']
+            timestamps = [ts for ts in (utils.parse_timestamp(getattr(r, 'created_at', None))
+                                        for t in resources for r in resources[t]) if ts]
+            if not timestamps:
+                self.logger.debug("No timestamp on the resources of project '%s', skipping it", project_name)
+                continue
+
+            age = now - max(timestamps)
+            if age < min_age:
+                continue
+            if not complete or (stale_age and age > stale_age):
+                orphans[project_name] = resources
+
+        # 4
+        self.logger.info("Garbage collection report (%s projects found, %s orphaned):", len(projects), len(orphans))
+        for project_name, resources in sorted(orphans.items()):
+            self.logger.info("  %s: %s", project_name, ", ".join("%s %s" % (len(resources[t]), t)
+                                                                 for t in sorted(resources) if resources[t]))
+
+        if not orphans:
+            return orphans
+        if not delete:
+            self.logger.info("Nothing was deleted, pass --yes to delete the orphaned resources")
+            return orphans
+
+        deleted_ids = self.delete_orphans(orphans, snapshot)
+        self.forget_collected_resources(orphans, deleted_ids)
+        return orphans
+
+    def snapshot_tenant(self):
+        """Lists every resource type of the tenant once (concurrently)."""
+        listings = [
+            ('network', self.network_api.networks),
+            ('subnet', self.network_api.subnets),
+            ('router', self.network_api.routers),
+            ('port', self.network_api.ports),
+            ('security_group', self.network_api.security_groups),
+            ('floating_ip', self.network_api.ips),
+            ('server', self.compute_api.servers),
+            ('keypair', self.compute_api.keypairs)
+        ]
+        self.logger.info("Taking a snapshot of the tenant's resources...")
+        results = utils.run_concurrently(lambda listing: list(listing[1]()), listings,
+                                         self.config['gc']['max_workers'])
+        return dict((listing[0], result) for listing, result in zip(listings, results))
+
+    def index_project_resources(self, snapshot):
+        """
+        Maps the snapshot of the tenant to projects by the naming conventions of the driver.
+
+        Only a network (`<project>_network`) or a security group (`<project>_secgroup`) makes a project. The other
+        resources are attached to the projects found that way, so a hyphenated server or a `*_ssh` keypair of
+        someone else is never taken for a project. Ports (other than the router port) are mapped through the network
+        they belong to.
+        """
+        projects = {}
+        patterns = dict(_PROJECT_RESOURCE_PATTERNS)
+
+        def project_names(resource_type):
+            source_type = 'port' if resource_type == 'router_port' else resource_type
+            for resource in snapshot[source_type]:
+                label = resource.description if resource_type == 'floating_ip' else resource.name
+                match = patterns[resource_type].match(label or '')
+                if match:
+                    yield match.group(1), resource
+
+        resource_types = [t for t, _ in _PROJECT_RESOURCE_PATTERNS] + ['port']
+        for resource_type in _PROJECT_ANCHOR_RESOURCES:
+            for project_name, _ in project_names(resource_type):
+                projects.setdefault(project_name, dict((t, []) for t in resource_types))
+
+        for resource_type, _ in _PROJECT_RESOURCE_PATTERNS:
+            for project_name, resource in project_names(resource_type):
+                if project_name in projects:
+                    projects[project_name][resource_type].append(resource)
+
+        network_projects = dict((network.id, project_name) for project_name, resources in projects.items()
+                                for network in resources['network'])
+        for port in snapshot['port']:
+            if port.network_id in network_projects and not (port.name or '').endswith('_router_port'):
+                projects[network_projects[port.network_id]]['port'].append(port)
+
+        return projects
+
+    def delete_orphans(self, orphans, snapshot):
+        """
+        Deletes the orphaned resources concurrently, one dependency level at a time.
+
+        :return: the IDs (and the names of the keypairs) of the deleted resources
+        :rtype: set
+        """
+        workers = self.config['gc']['max_workers']
+        deleted_ids = set()
+
+        def collect(resource_type):
+            return [r for resources in orphans.values() for r in resources[resource_type]]
+
+        def delete_each(description, delete_fn, resources):
+            def _delete(resource):
+                try:
+                    self.logger.info("Deleting %s '%s'", description, resource.name or resource.id)
+                    delete_fn(resource)
+                    return True
+                except Exception as e:
+                    self.logger.error("Failed to delete %s '%s': %s", description, resource.id, e)
+                    return False
+            for resource, deleted in zip(resources, utils.run_concurrently(_delete, resources, workers)):
+                if deleted:
+                    # the keypairs are journaled by name
+                    deleted_ids.update([resource.id, resource.name])
+
+        # floating ips (deleting also disassociates them)
+        delete_each('floating ip', lambda r: self.network_api.delete_ip(r.id, ignore_missing=True),
+                    collect('floating_ip'))
+
+        # servers, then wait for them to go away (their ports are deleted with them)
+        servers = collect('server')
+        delete_each('server', lambda r: self.compute_api.delete_server(r.id, ignore_missing=True), servers)
+        while servers:
+            self._sleep_poll()
+            alive = utils.run_concurrently(lambda r: self.compute_api.find_server(r.id), servers, workers)
+            servers = [server for server, found in zip(servers, alive) if found]
+
+        delete_each('ssh key pair', lambda r: self.compute_api.delete_keypair(r.name, ignore_missing=True),
+                    collect('keypair'))
+
+        # router interfaces and leftover ports
+        routers = collect('router')
+        router_ids = set(router.id for router in routers)
+        interfaces = [port for port in snapshot['port']
+                      if port.device_id in router_ids and port.device_owner == 'network:router_interface']
+        delete_each('router interface',
+                    lambda r: self.network_api.remove_interface_from_router(r.device_id, port_id=r.id), interfaces)
+        delete_each('port', lambda r: self.network_api.delete_port(r.id, ignore_missing=True),
+                    [port for port in collect('port') + collect('router_port')
+                     if not port.device_owner or not port.device_owner.startswith('network:')])
+
+        delete_each('router', lambda r: self.network_api.delete_router(r.id, ignore_missing=True), routers)
+        delete_each('subnet', lambda r: self.network_api.delete_subnet(r.id, ignore_missing=True),
+                    collect('subnet'))
+        delete_each('network', lambda r: self.network_api.delete_network(r.id, ignore_missing=True),
+                    collect('network'))
+        delete_each('security group', lambda r: self.network_api.delete_security_group(r.id, ignore_missing=True),
+                    collect('security_group'))
+        return deleted_ids
+
+    def forget_collected_resources(self, project_names, deleted_ids):
+        """
+        Removes the deleted resources from the state journals (of this driver's region) of the collected projects,
+        so that a later ID-based cleanup of such a project doesn't target resources that are gone.
+        """
+        region = None if self.region_name == self.default_region_name else self.region_name
+        for project_name in project_names:
+            journal = StateJournal(os.path.join(self.config['projects_dir'], project_name),
+                                   StateJournal.file_name_for_region(region))
+            if journal.exists():
+                self.logger.info("Removing the collected resources from state journal '%s'", journal.path)
+                journal.forget_ids(deleted_ids)
+                journal.clear_checkpoints()
+
     def check_available_resources(self):
-        self.logger.warn("'check_available_resources' NOT IMPLEMENTED YET")
+        """
+        Checks that the cluster fits into the compute limits and the network quota of the tenant.
+
+        Fetches the limits and their usage with two (concurrent) calls and compares them to the demand of the hosts
+        config. Every resource that doesn't fit is reported. If the cloud can't tell the limits, the check is skipped.
+
+        :return: the shortfalls (resource -> (needed, available)), empty if everything fits
+        :rtype: dict
+        """
+        from openstack.exceptions import SDKException
+
+        start_time = time.time()
+        demand = self.get_resource_demand()
+
+        try:
+            compute_limits, network_quota = utils.run_concurrently(lambda fn: fn(), [
+                self.compute_api.get_limits,
+                lambda: self.network_api.get_quota(self.connection.current_project_id, details=True)
+            ])
+        except SDKException as e:
+            # e.g. a Neutron without the quota_details extension
+            self.logger.warn("Can't read the limits of the tenant, skipping the resource check: %s", e)
+            return {}
+
+        absolute = compute_limits.absolute
+        quota = {
+            'instances': (absolute.instances, absolute.instances_used),
+            'cores': (absolute.total_cores, absolute.total_cores_used),
+            'ram': (absolute.total_ram, absolute.total_ram_used)
+        }
+        for resource in ['floating_ips', 'ports', 'networks', 'subnets', 'routers', 'security_groups',
+                         'security_group_rules']:
+            details = getattr(network_quota, resource, None) or {}
+            quota[resource] = (details.get('limit', -1), details.get('used', 0) + details.get('reserved', 0))
+
+        shortfalls = {}
+        for resource, needed in sorted(demand.items()):
+            limit, used = quota.get(resource, (-1, 0))
+            # -1 means unlimited
+            if not needed or limit is None or limit < 0:
+                continue
+            available = limit - (used or 0)
+            if needed > available:
+                shortfalls[resource] = (needed, available)
+                self.logger.error("Quota exceeded for '%s': needed %s, available %s (limit %s, used %s), short by %s",
+                                  resource, needed, available, limit, used, needed - available)
+
+        self.logger.info("Resource check for project '%s' took %.2f seconds (demand: %s)", self.project_name,
+                         time.time() - start_time, demand)
+        return shortfalls
+
+    def get_resource_demand(self):
+        """
+        Computes the resources the cluster needs from the hosts config and the flavors. When resuming, the steps
+        already done don't count.
+
+        :return: resource -> amount (ram in MB)
+        :rtype: dict
+        """
+        def done(step):
+            return self.resume and self.journal.is_checkpointed(step)
+
+        demand = dict((resource, 0) for resource in ['instances', 'cores', 'ram', 'floating_ips', 'ports', 'networks',
+                                                     'subnets', 'routers', 'security_groups', 'security_group_rules'])
+
+        for host, i in self.iterate_nodes():
+            flavor_name = host.get('vm_flavor', self.config['vm_management']['default_vm_flavor'])
+            try:
+                flavor = self.get_flavor(flavor_name)
+            except KeyError:
+                self.logger.error("Flavor '%s' of host '%s' doesn't exist. Quitting...", flavor_name, host['name'])
+                exit(1)
+
+            host_name = self.get_host_name(host, i)
+            if not done('server:' + host_name):
+                demand['instances'] += 1
+                demand['cores'] += flavor.vcpus
+                demand['ram'] += flavor.ram
+                demand['ports'] += 1
+            if self.get_cloud_vars(host, i).get('assignPublicIP') and not done('floating_ip:' + host_name):
+                demand['floating_ips'] += 1
+
+        if not done('network'):
+            demand['networks'] += 1
+            demand['subnets'] += 1
+            demand['routers'] += 1
+            # router interface and dhcp port
+            demand['ports'] += 2
+
+        if not done('security_group'):
+            demand['security_groups'] += 1
+            demand['security_group_rules'] += len(self.config['security_group']['rules'])
+
+        return demand
 
     def get_security_group(self, include_default=False):
         """
@@ -124,7 +925,7 @@ class OpenStackDriver:
 
     def create_security_group(self):
         """
-        Creates security group for the project and its default rules.
+        Creates security group for the project and its rules (`security_group.rules`, in a single bulk request).
 
         :return: The new security group object
         :rtype: :class:`OpenStackSecurityGroup`
@@ -134,18 +935,10 @@ class OpenStackDriver:
             self.logger.info("Creating security group '%s'", self._sec_group_name)
             sg = self.network_api.create_security_group(name=self._sec_group_name,
                                                         description="Security group for project '" + self.project_name + "'")
+            self.journal.record('security_group', self._sec_group_name, sg.id)
 
             self.logger.info("Creating security group rules for '%s'", self._sec_group_name)
-
-            self.network_api.create_security_group_rule(direction="ingress",
-                                                        ether_type="IPv4",
-                                                        port_range_min=1, port_range_max=65535, protocol="tcp",
-                                                        security_group_id=sg.id)
-
-            self.network_api.create_security_group_rule(direction="egress",
-                                                        ether_type="IPv4",
-                                                        port_range_min=1, port_range_max=65535, protocol="tcp",
-                                                        security_group_id=sg.id)
+            self.create_security_group_rules(sg, self.config['security_group']['rules'])
 
         else:
             self.logger.warn("A security group with the name '%s' already exists! "
@@ -155,26 +948,77 @@ class OpenStackDriver:
 
         return sg
 
+    def create_security_group_rules(self, sg, rules):
+        rules = [dict(rule, security_group_id=sg.id) for rule in rules]
+        if not rules:
+            return []
+        if hasattr(self.network_api, 'create_security_group_rules'):
+            return list(self.network_api.create_security_group_rules(rules))
+
+        # the bulk call is missing from the older openstacksdk releases (e.g. 0.39), one request per rule
+        return [self.network_api.create_security_group_rule(**rule) for rule in rules]
+
+    def apply_security_group_rules(self):
+        """
+        Diffs the rules of the project's security group against `security_group.rules` and sends only the changes:
+        the missing rules are created in one bulk request, the undeclared ones are deleted. The egress rules that
+        Neutron adds to every new group are left alone.
+
+        :return: the number of created and deleted rules
+        :rtype: tuple
+        """
+        sg_entry = self.journal.get('security_group', self._sec_group_name)
+        sg = self.network_api.find_security_group(sg_entry['id']) if sg_entry else self.get_security_group()
+        if not sg:
+            self.logger.error("Security group '%s' was not found. Quitting...", self._sec_group_name)
+            exit(1)
+
+        declared = dict((self._rule_key(rule), rule) for rule in self.config['security_group']['rules'])
+        existing = dict((self._rule_key(rule), rule) for rule in sg.security_group_rules)
+
+        to_create = [rule for key, rule in declared.items() if key not in existing]
+        to_delete = [rule for key, rule in existing.items()
+                     if key not in declared and not self._is_neutron_default_rule(rule)]
+
+        self.logger.info("Security group '%s': %s rules to create, %s rules to delete, %s unchanged",
+                         self._sec_group_name, len(to_create), len(to_delete), len(declared) - len(to_create))
+        self.create_security_group_rules(sg, to_create)
+        for rule in to_delete:
+            self.network_api.delete_security_group_rule(rule['id'])
+
+        return len(to_create), len(to_delete)
+
+    @staticmethod
+    def _rule_key(rule):
+        ether_type = rule.get('ether_type') or rule.get('ethertype') or 'IPv4'
+        protocol = rule.get('protocol')
+        return (rule.get('direction'), ether_type, str(protocol) if protocol is not None else None,
+                rule.get('port_range_min'), rule.get('port_range_max'), rule.get('remote_ip_prefix'),
+                rule.get('remote_group_id'))
+
+    @staticmethod
+    def _is_neutron_default_rule(rule):
+        return rule.get('direction') == 'egress' and not rule.get('protocol') and \
+            not rule.get('port_range_min') and not rule.get('remote_ip_prefix') and not rule.get('remote_group_id')
+
     def cleanup_security_group(self):
         sg = self.get_security_group()
         if sg:
-            self.logger.info("Cleaning up security group rules for '%s'", self._sec_group_name)
-            for rule in sg.security_group_rules:
-                self.network_api.delete_security_group_rule(rule)
+            # the rules are deleted along with the group
             self.logger.info("Cleaning up security group '%s'", self._sec_group_name)
             self.network_api.delete_security_group(sg)
         else:
             self.logger.warn("Security group '%s' was not found. Skipping...", self._sec_group_name)
 
     def get_proj_network(self):
-        if not OpenStackDriver.proj_network_cached:
-            OpenStackDriver.proj_network_cached = self.network_api.find_network(name_or_id=self._network_name)
-        return OpenStackDriver.proj_network_cached
+        if not self.proj_network_cached:
+            self.proj_network_cached = self.network_api.find_network(name_or_id=self._network_name)
+        return self.proj_network_cached
 
     def get_ext_net(self):
-        if not OpenStackDriver.ext_net_cached:
-            OpenStackDriver.ext_net_cached = self.network_api.find_network(name_or_id=self.config['network']['ext_net_name'])
-        return OpenStackDriver.ext_net_cached
+        if not self.ext_net_cached:
+            self.ext_net_cached = self.network_api.find_network(name_or_id=self.config['network']['ext_net_name'])
+        return self.ext_net_cached
 
     def create_network(self):
 
@@ -189,6 +1033,7 @@ class OpenStackDriver:
                 self.logger.debug("Next CIDR: '%s'", cidr)
 
             network = self.network_api.create_network(name=self._network_name)
+            self.journal.record('network', self._network_name, network.id)
             gateway_ip = cidr.replace('.0/24', '.1')
             subnet = self.network_api.create_subnet(
                 name=self._subnet_name,
@@ -197,15 +1042,19 @@ class OpenStackDriver:
                 cidr=cidr,
                 gateway_ip=gateway_ip
             )
+            self.journal.record('subnet', self._subnet_name, subnet.id, cidr=cidr)
             ext_net_network = self.get_ext_net()
             if ext_net_network:
                 router = self.network_api.create_router(
                     name=self._router_name,
                     external_gateway_info={'network_id': ext_net_network.id}
                 )
+                self.journal.record('router', self._router_name, router.id)
                 port = self.network_api.create_port(name=self._router_port_name, network_id=network.id,
                                                     fixed_ips=[{"subnet_id": subnet.id, "ip_address": gateway_ip}])
                 self.network_api.add_interface_to_router(router, subnet_id=subnet.id, port_id=port.id)
+                self.journal.record('router_port', self._router_port_name, port.id,
+                                    router=self._router_name, subnet=self._subnet_name)
             else:
                 self.logger.error("External gateway '%s' not found. Can't connect router to the external network...",
                                   self.config['network']['ext_net_name'])
@@ -215,6 +1064,8 @@ class OpenStackDriver:
                              "Be sure you used a unique project name! "
                              "Cluster creation doesn't continue. Quitting...", self._network_name)
 
+        return network
+
     def get_next_cidr(self):
         cidr_template = self.config['network']['cidr_template']
         subnets = list(self.network_api.subnets())
@@ -279,12 +1130,25 @@ class OpenStackDriver:
 
         kp = self.compute_api.find_keypair(name_or_id=self._ssh_key)
         if not kp:
-            self.logger.info("Creating ssh key pair %s and saving to %s", self._ssh_key, project_path)
-
-            key_pair = self.compute_api.create_keypair(name=self._ssh_key)
-            utils.save_string_to_file(key_pair.private_key, os.path.join(project_path, self._ssh_key),
-                                      chmod=(stat.S_IRUSR | stat.S_IWUSR))
-            utils.save_string_to_file(key_pair.public_key, os.path.join(project_path, self._ssh_key + ".pub"))
+            with OpenStackDriver._key_pair_lock:
+                public_key_path = os.path.join(project_path, self._ssh_key + ".pub")
+                if os.path.exists(public_key_path):
+                    # created by the driver of another region, import the same key
+                    self.logger.info("Importing ssh key pair %s from %s", self._ssh_key, project_path)
+                    with open(public_key_path, 'r') as public_key_stream:
+                        self.compute_api.create_keypair(name=self._ssh_key, public_key=public_key_stream.read())
+                    self.journal.record('keypair', self._ssh_key, self._ssh_key)
+                    return
+
+                self.logger.info("Creating ssh key pair %s and saving to %s", self._ssh_key, project_path)
+
+                key_pair = self.compute_api.create_keypair(name=self._ssh_key)
+                self.journal.record('keypair', self._ssh_key, self._ssh_key)
+                # not recorded into cassettes, a replayed keypair has no private key
+                if key_pair.private_key:
+                    utils.save_string_to_file(key_pair.private_key, os.path.join(project_path, self._ssh_key),
+                                              chmod=(stat.S_IRUSR | stat.S_IWUSR))
+                utils.save_string_to_file(key_pair.public_key, public_key_path)
 
     def cleanup_ssh_key_pair(self):
         self.logger.info("Cleaning up ssh key pair %s", self._ssh_key)
@@ -296,93 +1160,404 @@ class OpenStackDriver:
         else:
             self.logger.warn("SSH key pair %s not found. Skipping...", self._ssh_key)
 
-    def create_vms(self):
-        self.logger.info("Creating VMs...")
+    def lookup_cloud_resources(self):
+        """
+        Looks up (and caches) everything the VMs need from the cloud: images, flavors, default security group, ext-net.
 
-        security_groups = self.get_security_group(include_default=True)
-        if not security_groups:
-            self.logger.error("Error retrieving security group %s when creating nodes. Quitting...",
-                              self._sec_group_name)
-            exit(1)
+        :return: the default security group
+        """
+        self.get_image(self.config['vm_management']['default_image_name'])
+        self.get_flavor(self.config['vm_management']['default_vm_flavor'])
+        self.get_ext_net()
+        return next(iter(self.network_api.security_groups(name='default')), None)
 
-        network = self.get_proj_network()
-        if not network:
-            self.logger.error("Error retrieving network %s when creating nodes. Quitting...", self._network_name)
-            exit(1)
-        network_ids = [{'uuid': network.id}]
+    def create_vms(self, graph):
+        """
+        Adds a task for every VM of the region (and its floating IP if 'assignPublicIP' is set) to the task graph.
+        The VMs of the host groups returned by `get_multi_create_groups` are requested by one task per group, their
+        own tasks only wait for them.
+
+        :param graph: the task graph of create_cluster, it must contain the 'lookup', 'security_group', 'network' and
+                      'keypair' tasks
+        """
+        deps = ['lookup', 'security_group', 'network', 'keypair']
+        if self.config['vm_management']['precreate_ports']:
+            deps.append('ports')
 
-        default_image = self.get_image(self.config['vm_management']['default_image_name'])
+        multi_create_groups = self.get_multi_create_groups()
+        for host in self.config['hosts']:
+            if host['name'] in multi_create_groups:
+                graph.add('servers:' + self.get_host_name_base(host),
+                          self._vm_group_task(graph, host, multi_create_groups[host['name']]), deps=deps)
+
+        for host, i in self.iterate_nodes():
+            host_name = self.get_host_name(host, i)
+            server_task = 'server:' + host_name
+
+            if host['name'] in multi_create_groups:
+                group_task = 'servers:' + self.get_host_name_base(host)
+                graph.add(server_task, self._vm_of_group_task(graph, host, host_name, group_task, server_task),
+                          deps=[group_task])
+            else:
+                graph.add(server_task, self._vm_task(graph, host, i, server_task), deps=deps)
+
+            if self.get_cloud_vars(host, i).get('assignPublicIP'):
+                floating_ip_task = 'floating_ip:' + host_name
+                graph.add(floating_ip_task, self._floating_ip_task(graph, host_name, server_task, floating_ip_task),
+                          deps=[server_task])
+
+    def _vm_task(self, graph, host, i, step):
+        host_name = self.get_host_name(host, i)
+        return self._resumable(step,
+                               lambda: self.create_vm(host, i, [graph.result('lookup'),
+                                                                graph.result('security_group')],
+                                                      graph.result('network'),
+                                                      port=(graph.result('ports') or {}).get(host_name)),
+                               verify_fn=lambda: self._verify_server(host_name),
+                               rollback_fn=lambda: self._rollback_server(host_name),
+                               host_name=host_name)
+
+    def _vm_group_task(self, graph, host, indexes):
+        def task():
+            with telemetry.log_context(host=self.get_host_name_base(host)):
+                return self.create_vm_group(host, indexes, graph.result('network'))
+        return task
+
+    def _vm_of_group_task(self, graph, host, host_name, group_task, step):
+        # the group task has just created the server, there is nothing to roll back
+        return self._resumable(step,
+                               lambda: self.wait_for_vm(host, host_name, graph.result(group_task).get(host_name),
+                                                        [graph.result('lookup'), graph.result('security_group')]),
+                               verify_fn=lambda: self._verify_server(host_name),
+                               rollback_fn=lambda: None,
+                               host_name=host_name)
+
+    def _floating_ip_task(self, graph, host_name, server_task, step):
+        def create():
+            node = graph.result(server_task)
+            if not node:
+                # the VM was skipped (e.g. its flavor doesn't exist)
+                self.logger.warn("Node '%s' wasn't created, skipping its floating ip", host_name)
+                return None
+            return self.create_and_assign_floating_ip(host_name, node)
+
+        return self._resumable(step, create,
+                               verify_fn=lambda: self._verify_floating_ip(host_name),
+                               rollback_fn=lambda: self._rollback_floating_ip(host_name),
+                               host_name=host_name)
+
+    def get_server_args(self, host, i):
+        """
+        :return: the arguments of create_server shared by all the VMs booted like the i-th node of the host group
+                 (flavor, image, key pair, user data), None if the flavor doesn't exist
+        :rtype: dict
+        """
+        flavor_name = host.get('vm_flavor', self.config['vm_management']['default_vm_flavor'])
+        flavor = self.get_flavor(flavor_name)
+        if not flavor:
+            self.logger.error("Flavor '%s' doesn't exist. Skipping creating host '%s'", flavor_name,
+                              self.get_host_name(host, i))
+            return None
+
+        image_name = host.get('baked_image') or host.get('image_name') or \
+            self.config['vm_management']['default_image_name']
+        image = self.get_image(image_name)
+
+        server_args = {'flavor_id': flavor.id, 'image_id': image.id, 'key_name': self._ssh_key}
+        user_data = self.get_user_data(host, i)
+        if user_data:
+            server_args['user_data'] = user_data
+        return server_args
+
+    def create_vm(self, host, i, security_groups, network, port=None):
+        """
+        Creates the i-th VM of the host group and waits for it to become active.
+
+        :param port: the pre-created port to boot on (its security groups are set already), if None the VM gets a
+                     port on the network and the security groups are added once it's active
+        :return: the new node
+        """
+        host_name = self.get_host_name(host, i)
 
-        hosts = self.config['hosts']
-        new_nodes = []
+        server_args = self.get_server_args(host, i)
+        if not server_args:
+            return
 
-        self.logger.debug("Waiting for new nodes to start up...")
+        self.logger.info("Creating VM: %s", host_name)
         start_time = time.time()
 
-        for host in hosts:
-            cnt = host['count']
+        node = self.compute_api.create_server(
+            name=host_name,
+            networks=[{'port': port.id} if port else {'uuid': network.id}],
+            **server_args
+        )
 
-            for i in range(0, cnt):
-                host_name = self.project_name + "-" + host['name']
-                if cnt > 1:
-                    host_name = host_name + "_" + str(i + 1)
+        self.journal.record('server', host_name, node.id)
+        return self.wait_for_vm(host, host_name, (node, start_time), [] if port else security_groups)
 
-                flavor_name = host.get('vm_flavor', self.config['vm_management']['default_vm_flavor'])
-                flavor = self.get_flavor(flavor_name)
-                if not flavor:
-                    self.logger.error("Flavor '%s' doesn't exist. Skipping creating host '%s'", flavor_name, host_name)
-                    continue
-
-                image = default_image
-                if 'image' in host:
-                    image = self.get_image(host['image_name'])
-
-                self.logger.info("Creating VM: %s", host_name)
-
-                node = self.compute_api.create_server(
-                    name=host_name,
-                    flavor_id=flavor.id,
-                    image_id=image.id,
-                    key_name=self._ssh_key,
-                    networks=network_ids
-                )
+    def wait_for_vm(self, host, host_name, created, security_groups):
+        """
+        Waits for a requested VM to become active, then adds the security groups to it.
+
+        :param created: the requested node and the time of the request, None if it wasn't requested
+        :return: the active node
+        """
+        if not created:
+            return None
+        node, start_time = created
+        node = self.compute_api.wait_for_server(node, wait=self.config['vm_management']['hosts_startup_timeout'])
+        self.journal.update('server', host_name, status=node.status, addresses=node.addresses)
+        telemetry.metrics.observe('vm_boot_seconds', time.time() - start_time,
+                                  help_text="Time from create request to ACTIVE VM", host_group=host['name'])
+
+        for sg in security_groups:
+            if sg:
+                self.compute_api.add_security_group_to_server(node, sg)
+
+        self.logger.info("Startup for node %s took %s seconds", host_name, (time.time() - start_time))
+        return node
+
+    def get_multi_create_groups(self, ignore_journal=False):
+        """
+        Finds the host groups whose VMs in the region can be requested at once (vm_management.multi_create): more than
+        one VM, the same user data for every index, no pre-created ports and none of the VMs in the state journal yet
+        (a resumed group is created VM by VM).
+
+        :return: host group name -> indexes of its VMs in the region
+        :rtype: dict
+        """
+        vm_mgmt = self.config['vm_management']
+        if not vm_mgmt['multi_create'] or vm_mgmt['precreate_ports']:
+            return {}
+
+        indexes_by_group = {}
+        for host, i in self.iterate_nodes():
+            indexes_by_group.setdefault(host['name'], (host, []))[1].append(i)
+
+        groups = {}
+        for group, (host, indexes) in indexes_by_group.items():
+            if len(indexes) < 2:
+                continue
+            # flavor and image are per group, the region is the same, floating IPs are assigned after boot
+            if any(self.get_user_data(host, i) != self.get_user_data(host, indexes[0]) for i in indexes[1:]):
+                self.logger.debug("The user data of host group '%s' differs per index, its VMs are created one by one",
+                                  group)
+                continue
+            if not ignore_journal and any(self.journal.get('server', self.get_host_name(host, i)) for i in indexes):
+                continue
+            groups[group] = indexes
+        return groups
+
+    def create_vm_group(self, host, indexes, network):
+        """
+        Requests the VMs of a homogeneous host group with one multi-create (min_count = max_count) call, then maps the
+        instances of the reservation to the node names (`get_host_name`) by launch index and renames them.
+
+        :return: host name -> (node, time of the request)
+        :rtype: dict
+        """
+        count = len(indexes)
+        server_args = self.get_server_args(host, indexes[0])
+        if not server_args:
+            return {}
+
+        # a unique temporary name, the instances are found by it if the reservation id isn't visible
+        batch_name = "%s-%s" % (self.get_host_name_base(host), uuid.uuid4().hex[:8])
+        self.logger.info("Creating %s VMs of host group '%s' with one request (%s)", count, host['name'], batch_name)
+        start_time = time.time()
+
+        first = self.compute_api._create(
+            _MultiCreateServer,
+            name=batch_name,
+            networks=[{'uuid': network.id}],
+            min_count=count,
+            max_count=count,
+            **server_args
+        )
+
+        reservation_id = getattr(first, 'reservation_id', None) or \
+            getattr(self.compute_api.get_server(first.id), 'reservation_id', None)
+        if reservation_id:
+            servers = list(self.compute_api.servers(reservation_id=reservation_id))
+        else:
+            servers = list(self.compute_api.servers(name='^%s(-[0-9]+)?$' % utils.regex_escape(batch_name)))
+
+        if len(servers) != count:
+            self.logger.error("Multi-create of host group '%s' returned %s VMs instead of %s. Quitting...",
+                              host['name'], len(servers), count)
+            for server in servers:
+                self.journal.record('server', server.name, server.id)
+            exit(1)
+
+        def launch_order(server):
+            if getattr(server, 'launch_index', None) is not None:
+                return server.launch_index
+            # '<name>-<n>' by Nova's default multi_instance_display_name_template
+            suffix = server.name[len(batch_name) + 1:]
+            return int(suffix) if suffix.isdigit() else 0
+
+        created = {}
+        for i, server in zip(indexes, sorted(servers, key=launch_order)):
+            host_name = self.get_host_name(host, i)
+            self.journal.record('server', host_name, server.id)
+            self.compute_api.update_server(server, name=host_name)
+            created[host_name] = (server, start_time)
+
+        telemetry.metrics.inc('multi_create_vms_total', value=count, help_text="VMs created by multi-create requests",
+                              host_group=host['name'])
+        return created
+
+    def create_ports(self, network, security_groups):
+        """
+        Creates the ports of the region's VMs with bulk requests, the security groups are set on them so that the VMs
+        boot with the right rules. When resuming, the journaled ports that still exist are reused (one listing).
+
+        :return: host name -> port
+        :rtype: dict
+        """
+        security_group_ids = [sg.id for sg in security_groups if sg]
+        host_names = [self.get_host_name(host, i) for host, i in self.iterate_nodes()]
+
+        ports = {}
+        if self.resume:
+            journaled = dict((entry['id'], name) for name, entry in self.journal.resources('port').items())
+            for port in self.network_api.ports(network_id=network.id):
+                if port.id in journaled:
+                    ports[journaled[port.id]] = port
+            for name in self.journal.resources('port'):
+                if name not in ports:
+                    self.journal.forget('port', name)
+
+        missing = [host_name for host_name in host_names if host_name not in ports]
+        self.logger.info("Creating %s ports (%s reused) in bulk", len(missing), len(host_names) - len(missing))
+        bulk = hasattr(self.network_api, 'create_ports')
+        for start in range(0, len(missing), _PORTS_PER_BULK_REQUEST):
+            chunk = missing[start:start + _PORTS_PER_BULK_REQUEST]
+            ports_attrs = [{'name': host_name + "_port", 'network_id': network.id,
+                            'security_group_ids': security_group_ids} for host_name in chunk]
+            if bulk:
+                created = list(self.network_api.create_ports(ports_attrs))
+            else:
+                # the bulk call is missing from the older openstacksdk releases (e.g. 0.39), one request per port
+                created = [self.network_api.create_port(**port_attrs) for port_attrs in ports_attrs]
+            for host_name, port in zip(chunk, created):
+                self.journal.record('port', host_name, port.id)
+                ports[host_name] = port
+
+        return ports
+
+    def get_user_data(self, host, i):
+        """
+        Renders the cloud-init user data of the node (host 'user_data_template'), so that the base setup runs inside
+        the VM while it boots.
+
+        :return: the base64 encoded user data or None
+        """
+        if not host.get('user_data_template'):
+            return None
+
+        if not self._ansible_mgr:
+            self._ansible_mgr = AnsibleManager(self.config, self.project_name)
+
+        user_data = self._ansible_mgr.render_user_data(host, i)
+        return base64.b64encode(user_data.encode('utf-8')).decode('ascii')
+
+    def bake_images(self):
+        """
+        Snapshots the first node of every host group into a project-tagged image ("golden image").
 
-                new_nodes.append(node)
-                self.compute_api.wait_for_server(node)
+        Run it after a successful ansible setup, then set the logged image names as `baked_image` of the host groups
+        so that future clusters boot with the software stack already installed.
 
-                for sg in security_groups:
-                    self.compute_api.add_security_group_to_server(node, sg)
+        :return: host group name -> image name
+        :rtype: dict
+        """
+        self.logger.info("Baking images for project '%s'...", self.project_name)
+
+        nodes = self.journal_nodes() if self.journal.exists() else self.list_nodes()
+        nodes_dict = dict((node.name, node) for node in nodes)
+        timestamp = time.strftime('%Y%m%d-%H%M%S')
+
+        # the first node of every host group in the region
+        first_nodes = []
+        for host, i in self.iterate_nodes():
+            if host not in [h for h, _ in first_nodes]:
+                first_nodes.append((host, i))
+
+        baked_images = {}
+        for host, i in first_nodes:
+            host_name = self.get_host_name(host, i)
+            node = nodes_dict.get(host_name)
+            if not node:
+                self.logger.error("Node '%s' not found. Skipping baking host group '%s'...", host_name, host['name'])
+                continue
 
-        self.logger.info("Startup for %s nodes took %s seconds", len(new_nodes), (time.time() - start_time))
+            image_name = "%s-%s-baked-%s" % (self.project_name, host['name'], timestamp)
+            self.logger.info("Snapshotting node '%s' into image '%s'", host_name, image_name)
+            self.compute_api.create_server_image(node.id, image_name,
+                                                 metadata={'lusheeta_project': self.project_name,
+                                                           'lusheeta_host_group': host['name']})
+            baked_images[host['name']] = image_name
+
+        # snapshots run in parallel in the cloud, wait for all of them
+        self.logger.debug("Waiting for images to become active...")
+        timeout = time.time() + self.config['vm_management']['hosts_startup_timeout']
+        pending = dict(baked_images)
+        while pending and time.time() < timeout:
+            self._sleep_poll()
+            for host_group, image_name in list(pending.items()):
+                image = self.compute_api.find_image(image_name)
+                if image and image.status == 'ACTIVE':
+                    self.journal.record('image', image_name, image.id, host_group=host_group)
+                    del pending[host_group]
+                elif image and image.status == 'ERROR':
+                    self.logger.error("Baking image '%s' failed", image_name)
+                    del baked_images[host_group]
+                    del pending[host_group]
+
+        for host_group, image_name in pending.items():
+            self.logger.error("Image '%s' is not active after %s seconds", image_name,
+                              self.config['vm_management']['hosts_startup_timeout'])
+            del baked_images[host_group]
+
+        for host_group, image_name in baked_images.items():
+            self.logger.info("Host group '%s' baked: set 'baked_image: %s' to boot from it", host_group, image_name)
+
+        return baked_images
+
+    def reset_project_caches(self):
+        """Drops what another action (or another process) may have changed since it was cached."""
+        self.resume = False
+        self.proj_network_cached = None
 
     def get_image(self, name):
-        if not OpenStackDriver.cloud_images_dict:
+        # an unknown name reloads the list (e.g. an image baked since it was loaded by a long-running process)
+        if not self.cloud_images_dict or name not in self.cloud_images_dict:
             cloud_images = self.compute_api.images()
             if not cloud_images:
                 self.logger.error("Error retrieving image list. Quitting...")
                 exit(1)
-            OpenStackDriver.cloud_images_dict = dict((x.name, x) for x in cloud_images)
+            self.cloud_images_dict = dict((x.name, x) for x in cloud_images)
 
-        return OpenStackDriver.cloud_images_dict[name]
+        return self.cloud_images_dict[name]
 
     def get_flavor(self, name):
-        if not OpenStackDriver.flavors_dict:
+        if not self.flavors_dict:
             flavors_list = self.compute_api.flavors()
             if not flavors_list:
                 self.logger.error("Error retrieving flavors. Quitting...")
                 exit(1)
-            OpenStackDriver.flavors_dict = dict((x.name, x) for x in flavors_list)
+            self.flavors_dict = dict((x.name, x) for x in flavors_list)
 
-        return OpenStackDriver.flavors_dict[name]
+        return self.flavors_dict[name]
 
     def terminate_vms(self):
         self.logger.info("Terminating VMs...")
-        nodes = list(self.compute_api.servers())
         node_names = []
 
         self.iterate_through_hosts(lambda n: node_names.append(n))
 
-        for node in nodes:
+        for node in list(self.iter_nodes()):
             if node.name in node_names:
                 self.logger.info("Terminating VM: %s", node.name)
                 self.compute_api.delete_server(node.id)
@@ -392,84 +1567,125 @@ class OpenStackDriver:
         wait_more = True
         while wait_more:
             self.logger.debug("Still waiting for nodes to terminate...")
-            time.sleep(self.config['vm_management']['terminate_vm_poll'])
-            nodes = self.compute_api.servers()
-            wait_more = any(node.name in node_names for node in nodes)
+            self._sleep_poll()
+            wait_more = any(node.name in node_names for node in self.iter_nodes())
 
         self.logger.debug("All nodes terminated...")
 
-    def process_cloud_vars(self):
-        nodes = list(self.compute_api.servers())
+    def get_cloud_vars(self, host, i):
+        """
+        :return: the cloud_vars that apply to the i-th node of the host group (index 'all', 'counter' or i)
+        :rtype: dict
+        """
+        cloud_vars = {}
+        for cloud_var in host.get('cloud_vars', []):
+            index = cloud_var.get('index', 'all')
+            if index == 'all' or index == 'counter' or index == i:
+                cloud_vars.update((k, v) for k, v in cloud_var.items() if k != 'index')
+        return cloud_vars
+
+    def create_and_assign_floating_ip(self, host_name, node):
+        ext_net = self.get_ext_net()
 
-        for host in self.config['hosts']:
-            cnt = host['count']
+        with telemetry.metrics.timer('floating_ip_seconds', help_text="Duration of floating ip operations",
+                                     op='create_and_assign'):
+            floating_ip = self.network_api.create_ip(description="Floating IP for " + host_name,
+                                                     floating_network_id=ext_net.id)
 
-            if 'cloud_vars' in host:
-                for cloud_var in host['cloud_vars']:
-                    index = 'all'
-                    if 'index' in cloud_var:
-                        index = cloud_var['index']
+            self.journal.record('floating_ip', host_name, floating_ip.id, address=floating_ip.floating_ip_address)
 
-                    if 'assignPublicIP' in cloud_var:
-                        if cloud_var['assignPublicIP']:
-                            self.create_and_assign_floating_ip(host, index, nodes)
+            self.logger.info("Creating floating ip and assigning to node %s", host_name)
+            self.compute_api.add_floating_ip_to_server(node, floating_ip.floating_ip_address)
+            self.record_floating_address(host_name, floating_ip.floating_ip_address)
+        telemetry.metrics.inc('floating_ips_total', help_text="Floating ip operations", op='create_and_assign')
 
-    def create_and_assign_floating_ip(self, host, index, nodes):
-        def pick_node(_nodes, name):
-            for n in _nodes:
-                if n.name == name:
-                    return n
+    def record_floating_address(self, host_name, address):
+        server = self.journal.get('server', host_name)
+        if not server:
+            return
 
-        ext_net = self.get_ext_net()
+        addresses = server['data'].get('addresses', {})
+        addresses.setdefault(self._network_name, []).append({'addr': address, 'version': 4,
+                                                             'OS-EXT-IPS:type': 'floating'})
+        self.journal.update('server', host_name, addresses=addresses)
 
-        cnt = host['count']
-        if index == 'all' or index == 'counter':
-            index = range(0, cnt)
-        else:
-            index = range(index, index + 1)
+    def get_host_name_base(self, host):
+        return self.project_name + "-" + host['name']
 
-        for i in index:
-            host_name = self.project_name + "-" + host['name']
-            if cnt > 1:
-                host_name = host_name + "_" + str(i + 1)
-            floating_ip = self.network_api.create_ip(description="Floating IP for " + host_name,
-                                                     floating_network_id=ext_net.id)
+    def get_host_name(self, host, i):
+        host_name = self.get_host_name_base(host)
+        if host['count'] > 1:
+            host_name = host_name + "_" + str(i + 1)
+        return host_name
 
-            node = pick_node(nodes, host_name)
-            self.logger.info("Creating floating ip and assigning to node %s", host_name)
-            self.compute_api.add_floating_ip_to_server(node, floating_ip.floating_ip_address)
+    def get_node_region(self, host, i):
+        return self.get_cloud_vars(host, i).get('region') or host.get('region') or self.default_region_name
 
-    def iterate_through_hosts(self, action):
+    def iterate_nodes(self):
+        """Yields (host, index) of every node placed in the region of this driver."""
         for host in self.config['hosts']:
-            cnt = host['count']
+            for i in range(0, host['count']):
+                if self.get_node_region(host, i) == self.region_name:
+                    yield host, i
 
-            for i in range(0, cnt):
-                host_name = self.project_name + "-" + host['name']
-                if cnt > 1:
-                    host_name = host_name + "_" + str(i + 1)
-
-                action(host_name)
+    def iterate_through_hosts(self, action):
+        for host, i in self.iterate_nodes():
+            action(self.get_host_name(host, i))
 
     def disassociate_floating_ips(self):
         self.logger.info("Disassociating public ips from VMs...")
 
-        nodes = self.compute_api.servers()
         node_names = []
         self.iterate_through_hosts(lambda n: node_names.append(n))
 
         floating_ips = self.network_api.ips()
         floating_ips_dict = dict((x.floating_ip_address, x) for x in floating_ips)
 
-        for node in nodes:
+        for node in self.iter_nodes():
             if node.name in node_names:
                 if self._network_name in node.addresses and node.addresses[self._network_name]:
                     for ip_to_detach in node.addresses[self._network_name]:
                         if ip_to_detach['OS-EXT-IPS:type'] != 'fixed':
                             self.logger.info("Detaching ip '%s' from node '%s'", ip_to_detach['addr'], node.name)
-                            self.compute_api.remove_floating_ip_from_server(node, ip_to_detach['addr'])
+                            self.compute_api.remove_floating_ip_from_server(node.id, ip_to_detach['addr'])
 
                             self.logger.info("Deleting floating ip '%s'", ip_to_detach)
                             self.network_api.delete_ip(floating_ips_dict[ip_to_detach['addr']])
 
+    def _sleep_poll(self):
+        # a replay scales the poll interval like the API latencies
+        seconds = self.config['vm_management']['terminate_vm_poll']
+        if self.cassette:
+            self.cassette.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
     def list_nodes(self):
-        return list(self.compute_api.servers())
+        return list(self.iter_nodes())
+
+    def journal_nodes(self):
+        """
+        The servers recorded in the state journal of the region, no cloud API call is made (offline mode).
+
+        :rtype: list of :class:`NodeRecord`
+        """
+        return [NodeRecord(name=name, id=entry['id'], status=entry['data'].get('status'),
+                           addresses=entry['data'].get('addresses', {}))
+                for name, entry in self.journal.resources('server').items()]
+
+    def iter_nodes(self, status=None):
+        """
+        Streams the servers of the project: the name prefix (and status) filters are applied by Nova, the pages are
+        fetched lazily and every server is projected to a compact node record.
+
+        :param status: only the servers in this state (e.g. 'ACTIVE', 'ERROR')
+        :rtype: generator of :class:`NodeRecord`
+        """
+        filters = {'name': '^%s-' % utils.regex_escape(self._vm_prefix)}
+        if status:
+            filters['status'] = status.upper()
+
+        for server in self.compute_api.servers(**filters):
+            # the name filter is a regex on the Nova side, double check the prefix
+            if server.name.startswith(self._vm_prefix + "-"):
+                yield NodeRecord(name=server.name, id=server.id, status=server.status, addresses=server.addresses)
@@ -2,13 +2,17 @@
 
 import argparse
 import logging
+import os
+import clilib.daemon as daemon
+import clilib.telemetry as telemetry
 import clilib.utils as utils
 
 from clilib.cloud_cli import CloudCLI
 
 
 if __name__ == "__main__":
-    allowed_actions = ["create", "cleanup", "prepare_ansible", "run_ansible"]
+    allowed_actions = ["create", "cleanup", "prepare_ansible", "run_ansible", "bake", "gc",
+                       "apply_security_group", "status", "plan", "daemon"]
 
     # setup command line arguments
     parser = argparse.ArgumentParser(description="CPSWTNG Cloud CLI tool")
@@ -18,7 +22,30 @@ if __name__ == "__main__":
                         help="path to the configuration file")
     parser.add_argument("-v", "--verbose",
                         help="set verbosity mode", action="count")
-    parser.add_argument("project", nargs=1, help="the name of the project")
+    parser.add_argument("--offline", action="store_true",
+                        help="prepare_ansible: use the project's state journal instead of querying the cloud")
+    parser.add_argument("--resume", action="store_true",
+                        help="create: continue an interrupted cluster creation from its last checkpoint")
+    parser.add_argument("--incremental", action="store_true",
+                        help="run_ansible: only run on the hosts changed since the last successful run")
+    parser.add_argument("--yes", action="store_true",
+                        help="gc: delete the orphaned resources (without it they are only reported)")
+    parser.add_argument("--plan-action", choices=["create", "cleanup"], default="create",
+                        help="plan: the action to plan (default: %(default)s)")
+    parser.add_argument("--node-status",
+                        help="status: only list the nodes in this state (e.g. ACTIVE, ERROR)")
+    parser.add_argument("--record", metavar="CASSETTE",
+                        help="record the cloud API traffic (requests, responses, latencies) into this file")
+    parser.add_argument("--replay", metavar="CASSETTE",
+                        help="replay a recorded cloud API traffic instead of connecting to the cloud")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="replay: divide the recorded latencies by this factor, 0 means no waiting "
+                             "(default: %(default)s)")
+    parser.add_argument("--socket", default=daemon.DEFAULT_SOCKET_PATH,
+                        help="the Unix socket of the daemon (default: %(default)s)")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="run the action in this process even if a daemon is running")
+    parser.add_argument("project", nargs="?", help="the name of the project (not used by the daemon action)")
 
     # parse command line args
     args = parser.parse_args()
@@ -27,15 +54,58 @@ if __name__ == "__main__":
     config_file = "config/default.yml"
     if args.config:
         config_file = args.config
-    cli_config = utils.load_yaml_config(config_file)
     verbose_level = args.verbose
-    project_name_in = args.project[0].lower()
+
+    options = {
+        'offline': args.offline,
+        'yes': args.yes,
+        'resume': args.resume,
+        'incremental': args.incremental,
+        'node_status': args.node_status,
+        'plan_action': args.plan_action,
+        'record': args.record and os.path.abspath(args.record),
+        'replay': args.replay and os.path.abspath(args.replay),
+        'replay_speed': args.replay_speed
+    }
+
+    if action == "daemon":
+        cli_config = utils.load_yaml_config(config_file)
+        telemetry_settings = cli_config.get('telemetry') or {}
+        telemetry.setup_logging(utils.get_log_level(verbose_level),
+                                log_file=telemetry_settings.get('log_file', "cloud_cli.log"),
+                                json_lines=telemetry_settings.get('json_logs', True))
+        daemon.LusheetaDaemon(args.socket).serve_forever()
+        exit(0)
+
+    if not args.project:
+        parser.error("the project argument is required for the '%s' action" % action)
+
+    project_name_in = args.project.lower()
 
     project_name = ''.join(c for c in project_name_in if c.isalnum())
 
+    # hand the action over to the daemon if one is running (it has everything loaded and authenticated), recording and
+    # replaying need a connection of their own
+    if not (args.no_daemon or args.record or args.replay):
+        return_code = daemon.forward({
+            'action': action,
+            'project': project_name,
+            'config_file': os.path.abspath(config_file if isinstance(config_file, basestring) else config_file.name),
+            'cwd': os.getcwd(),
+            'options': options,
+            'log_level': utils.get_log_level(verbose_level)
+        }, args.socket)
+        if return_code is not None:
+            exit(return_code)
+
+    cli_config = utils.load_yaml_config(config_file)
+
     # setup logger
-    logging.basicConfig(level=utils.get_log_level(verbose_level))
-    logging.getLogger().addHandler(logging.FileHandler("cloud_cli.log"))
+    telemetry_settings = cli_config.get('telemetry') or {}
+    telemetry.setup_logging(utils.get_log_level(verbose_level),
+                            log_file=telemetry_settings.get('log_file', "cloud_cli.log"),
+                            json_lines=telemetry_settings.get('json_logs', True))
+    telemetry.set_context(project=project_name, action=action)
     logger = logging.getLogger(__name__)
 
     # overwrite config.project with the passed value (may be different)
@@ -54,5 +124,5 @@ if __name__ == "__main__":
                  "verbose_level = '%s'\t"
                  "project_name = '%s'", action, config_file, verbose_level, project_name)
 
-    cli = CloudCLI(action=action, config=cli_config, project_name=project_name)
+    cli = CloudCLI(action=action, config=cli_config, project_name=project_name, options=options)
     cli.run()
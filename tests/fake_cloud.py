@@ -0,0 +1,193 @@
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+# listing call -> resource type
+_LISTINGS = {'networks': 'network', 'subnets': 'subnet', 'routers': 'router', 'ports': 'port',
+             'security_groups': 'security_group', 'ips': 'ip', 'servers': 'server', 'keypairs': 'keypair',
+             'images': 'image', 'flavors': 'flavor'}
+
+
+class FakeResource(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+    def __getattr__(self, name):
+        # unset SDK attributes read as None
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class FakeApi(object):
+    """
+    An in-memory network or compute proxy: create_<type>, find_<type>, get_<type>, delete_<type> and the listings
+    work on the resources of the cloud, every call is recorded in `calls` as (name, args, kwargs). The bulk calls
+    create_<type>s create every resource of their list.
+    """
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.calls = []
+        # calls the proxy doesn't have, like those of an older SDK
+        self.missing = set()
+
+    def called(self, name):
+        return [call for call in self.calls if call[0] == name]
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in self.missing:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            with self.cloud.lock:
+                self.calls.append((name, args, kwargs))
+            return self.cloud.handle(name, args, kwargs)
+
+        return call
+
+
+class FakeCloud(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = []
+        self._ids = itertools.count(1)
+        self.network = FakeApi(self)
+        self.compute = FakeApi(self)
+
+    def add(self, resource_type, **attrs):
+        attrs.setdefault('id', '%s-%s' % (resource_type, next(self._ids)))
+        resource = FakeResource(resource_type=resource_type, **attrs)
+        with self.lock:
+            self.resources.append(resource)
+        return resource
+
+    def of_type(self, resource_type):
+        return [r for r in self.resources if r.resource_type == resource_type]
+
+    def find(self, resource_type, key):
+        key = getattr(key, 'id', key)
+        return next((r for r in self.of_type(resource_type) if key in (r.id, r.name)), None)
+
+    def handle(self, name, args, kwargs):
+        if name in _LISTINGS:
+            found = self.of_type(_LISTINGS[name])
+            if kwargs.get('name'):
+                found = [r for r in found if re.search(kwargs['name'], r.name or '')]
+            for attr in ('status', 'network_id'):
+                if kwargs.get(attr):
+                    found = [r for r in found if getattr(r, attr) == kwargs[attr]]
+            return iter(found)
+
+        if name == '_create':
+            # the request body of the SDK resource, like Nova gets it (a multi-create names the instances <name>-<n>)
+            body = args[0].new(**kwargs)._body.dirty
+            count = body.get('min_count', 1)
+            names = ['%s-%s' % (body['name'], i + 1) for i in range(count)] if count > 1 else [body['name']]
+            return [self.add('server', name=server_name) for server_name in names][0]
+
+        if name == 'remove_interface_from_router':
+            # the router port goes away with the interface
+            port_id = kwargs.get('port_id') or (args[2] if len(args) > 2 else None)
+            return self.handle('delete_port', (port_id,), {})
+
+        action, _, resource_type = name.partition('_')
+        if action == 'create' and args and isinstance(args[0], list):
+            return [self.add(resource_type[:-1], **attrs) for attrs in args[0]]
+        if action == 'create':
+            return self.add(resource_type, **kwargs)
+        if action in ('find', 'get'):
+            return self.find(resource_type, args[0] if args else kwargs.get('name_or_id'))
+        if action == 'delete':
+            resource = self.find(resource_type, args[0])
+            if resource:
+                with self.lock:
+                    self.resources.remove(resource)
+            return None
+        return None
+
+
+class FakeCassette(object):
+    """Hands the fake cloud to the driver in place of a live connection (see `Cassette.wrap_connection`)."""
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self.connections = 0
+
+    def wrap_connection(self, connection_factory, region):
+        self.connections += 1
+        return FakeResource(network=self.cloud.network, compute=self.cloud.compute, cluster=None, identity=None,
+                            current_project_id='project-id')
+
+    def sleep(self, seconds):
+        pass
+
+
+class DriverTestCase(object):
+    """Mixin creating an OpenStackDriver of project 'proj' on a fake cloud, in a temporary projects dir."""
+
+    def setUp(self):
+        from extension.openstack_extension import OpenStackDriver
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_file = os.path.join(self.tmp_dir, 'openstack.yml')
+        with open(settings_file, 'w') as settings_stream:
+            settings_stream.write("username: u\npassword: p\nproject_name: tenant\nauth_url_base: http://keystone\n"
+                                  "region_name: regionOne\n")
+
+        self.config = {
+            'project': 'proj',
+            'project_path': os.path.join(self.tmp_dir, 'proj'),
+            'projects_dir': self.tmp_dir,
+            'platform_settings': {'settings_file': settings_file},
+            'regions': {},
+            'hosts': [],
+            'network': {'cidr': 'auto', 'cidr_template': '10.X.100.0/24', 'ext_net_name': 'ext-net'},
+            'vm_management': {'terminate_vm_poll': 0, 'hosts_startup_timeout': 600, 'max_parallel': 4,
+                              'precreate_ports': False, 'multi_create': False},
+            'gc': {'min_age_hours': 1, 'stale_age_hours': 0, 'max_workers': 4}
+        }
+        os.makedirs(self.config['project_path'])
+
+        self.cloud = FakeCloud()
+        self.cassette = FakeCassette(self.cloud)
+        self.driver = OpenStackDriver(self.config, 'proj', cassette=self.cassette)
+
+
+class CliTestCase(object):
+    """Mixin building the CloudCLI of project 'proj' in a temporary projects dir, the SDK connections fail."""
+
+    def setUp(self):
+        import mock
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.settings_file = os.path.join(self.tmp_dir, 'openstack.yml')
+        with open(self.settings_file, 'w') as settings_stream:
+            settings_stream.write("username: u\npassword: p\nproject_name: tenant\nauth_url_base: http://keystone\n"
+                                  "region_name: regionOne\n")
+        self.config = {
+            'platform': 'openstack',
+            'platform_settings_file': self.settings_file,
+            'project': 'proj',
+            'projects_dir': self.tmp_dir,
+            'hosts': [{'name': 'a', 'count': 1, 'cloud_vars': [{'region': 'regionTwo'}]},
+                      {'name': 'b', 'count': 1}]
+        }
+        self.project_path = os.path.join(self.tmp_dir, 'proj')
+
+        patcher = mock.patch('openstack.connection.Connection', side_effect=AssertionError("connected"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cli(self, action, config=None, **options):
+        from clilib.cloud_cli import CloudCLI
+
+        return CloudCLI(action, config or self.config, 'proj', options)
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import yaml
+
+from clilib.ansible_mgr import AnsibleManager
+
+
+class VarsDirsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.config = {
+            'project_path': self.tmp_dir,
+            'ansible': {'templates_path': self.tmp_dir},
+            'hosts': [{'name': 'master', 'count': 2, 'ansible_settings': [
+                {'ansible_group': 'zookeeper',
+                 'group_vars': [{'index': 'counter', 'zk_id': None}, {'index': 'all', 'zk_port': 2181},
+                                {'index': 0, 'zk_leader': True}]}]}]
+        }
+        self.mgr = AnsibleManager(self.config, 'proj')
+
+    def read_vars(self, dir_name, name):
+        with open(os.path.join(self.tmp_dir, dir_name, name + '.yml'), 'r') as vars_stream:
+            return yaml.safe_load(vars_stream)
+
+    def test_values_keep_their_types(self):
+        self.mgr._generate_vars_dirs(self.mgr.build_inventory([]))
+
+        self.assertEqual(self.read_vars('group_vars', 'zookeeper'), {'zk_port': 2181})
+        self.assertEqual(self.read_vars('host_vars', 'master_1'), {'zk_id': 1, 'zk_leader': True})
+        self.assertEqual(self.read_vars('host_vars', 'master_2'), {'zk_id': 2})
+
+
+class IncrementalLimitTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.config = {
+            'project_path': self.tmp_dir,
+            'ansible': {'templates_path': self.tmp_dir, 'dependent_groups': {'masters': ['agents']}}
+        }
+        self.mgr = AnsibleManager(self.config, 'proj')
+
+        os.makedirs(os.path.join(self.tmp_dir, 'facts'))
+        for host_name in ['master_1', 'agent_1', 'agent_2']:
+            self.write(os.path.join('facts', host_name), {'ansible_default_ipv4': {}})
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp_dir, name), 'w') as stream:
+            json.dump(content, stream)
+
+    def test_changed_hosts_and_their_dependents(self):
+        self.write('ansible_applied.json', {'masters': {'master_1': {'ansible_host': '10.0.0.1'}},
+                                            'agents': {'agent_1': {}, 'agent_2': {}}})
+        # master_1 was replaced by a new VM
+        self.write('ansible_inventory.json', {'masters': {'master_1': {'ansible_host': '10.0.0.9'}},
+                                              'agents': {'agent_1': {}, 'agent_2': {}}})
+
+        self.assertEqual(self.mgr.get_incremental_limit(), ['agent_1', 'agent_2', 'master_1'])
+        # the facts of the old VM are gone, the unchanged hosts keep theirs
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmp_dir, 'facts'))), ['agent_1', 'agent_2'])
+
+    def test_whole_inventory_without_a_snapshot(self):
+        self.write('ansible_applied.json', {'masters': {'master_1': {}}})
+
+        self.assertIsNone(self.mgr.get_incremental_limit())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from tests.fake_cloud import DriverTestCase
+
+
+class IdBasedCleanupTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        journal = self.driver.journal
+        for resource_type, name in [('security_group', 'proj_secgroup'), ('network', 'proj_network'),
+                                    ('subnet', 'proj_network_subnet'), ('router', 'proj_network_router'),
+                                    ('keypair', 'proj_ssh'), ('server', 'proj-a_1'), ('server', 'proj-a_2')]:
+            resource = self.cloud.add(resource_type, name=name)
+            journal.record(resource_type, name, resource.id)
+        router_port = self.cloud.add('port', name='proj_network_router_port')
+        journal.record('router_port', 'proj_network_router_port', router_port.id, router='proj_network_router',
+                       subnet='proj_network_subnet')
+        ip = self.cloud.add('ip', floating_ip_address='1.2.3.4')
+        journal.record('floating_ip', 'proj-a_1', ip.id, address='1.2.3.4')
+        journal.checkpoint('server:proj-a_1')
+
+        # not the project's
+        self.cloud.add('server', name='other-1')
+
+    def test_deletes_the_journaled_resources_by_id(self):
+        self.driver.cleanup_cluster()
+
+        self.assertEqual([r.name for r in self.cloud.resources], ['other-1'])
+        # no listing of the tenant
+        self.assertEqual(self.cloud.compute.called('servers'), [])
+        self.assertEqual(self.cloud.network.called('ips'), [])
+        self.assertEqual(len(self.cloud.network.called('remove_interface_from_router')), 1)
+
+    def test_forgets_resources_and_checkpoints(self):
+        self.driver.cleanup_cluster()
+
+        self.assertTrue(self.driver.journal.is_empty())
+        self.assertFalse(self.driver.journal.is_checkpointed('server:proj-a_1'))
+
+    def test_empty_journal_falls_back_to_the_name_lookup(self):
+        self.driver.cleanup_cluster()
+        self.cloud.add('server', name='proj-a_1', status='ACTIVE', addresses={})
+        self.driver.journal.checkpoint('lookup')
+        self.config['hosts'] = [{'name': 'a', 'count': 2, 'cloud_vars': []}]
+
+        self.driver.cleanup_cluster()
+
+        self.assertTrue(self.cloud.compute.called('servers'))
+        self.assertEqual([r.name for r in self.cloud.resources], ['other-1'])
+        self.assertFalse(self.driver.journal.is_checkpointed('lookup'))
+
+
+if __name__ == '__main__':
+    unittest.main()
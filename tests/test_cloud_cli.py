@@ -0,0 +1,24 @@
+import copy
+import unittest
+
+import clilib.utils as utils
+
+from tests.fake_cloud import CliTestCase
+
+
+class PlatformSettingsTest(CliTestCase, unittest.TestCase):
+    def test_settings_file_of_a_project_doesnt_leak(self):
+        platforms = copy.deepcopy(utils.load_supported_platforms_config())
+
+        self.cli('status')
+        other_config = dict(self.config)
+        del other_config['platform_settings_file']
+        other = self.cli('status', other_config)
+
+        self.assertEqual(utils.load_supported_platforms_config(), platforms)
+        self.assertEqual(other.config['platform_settings']['settings_file'], './config/openstack.yml')
+        self.assertEqual(self.config['platform_settings']['settings_file'], self.settings_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
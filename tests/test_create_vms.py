@@ -0,0 +1,53 @@
+import unittest
+import uuid
+
+import mock
+
+from clilib.task_graph import TaskGraph
+from tests.fake_cloud import DriverTestCase
+
+
+class FloatingIpTaskTest(DriverTestCase, unittest.TestCase):
+    def test_skipped_when_the_vm_was_not_created(self):
+        graph = TaskGraph()
+        # create_vm returns None when the flavor doesn't exist
+        graph.add('server:proj-a', lambda: None)
+        graph.add('floating_ip:proj-a',
+                  self.driver._floating_ip_task(graph, 'proj-a', 'server:proj-a', 'floating_ip:proj-a'),
+                  deps=['server:proj-a'])
+        graph.run()
+
+        self.assertEqual(self.cloud.network.called('create_ip'), [])
+        self.assertEqual(self.cloud.compute.called('add_floating_ip_to_server'), [])
+        self.assertIsNone(self.driver.journal.get('floating_ip', 'proj-a'))
+
+    def test_created_for_the_vm(self):
+        self.cloud.add('network', name='ext-net', is_router_external=True)
+        server = self.cloud.add('server', name='proj-a')
+        graph = TaskGraph()
+        graph.add('server:proj-a', lambda: server)
+        graph.add('floating_ip:proj-a',
+                  self.driver._floating_ip_task(graph, 'proj-a', 'server:proj-a', 'floating_ip:proj-a'),
+                  deps=['server:proj-a'])
+        graph.run()
+
+        self.assertEqual(len(self.cloud.network.called('create_ip')), 1)
+        self.assertEqual(self.cloud.compute.called('add_floating_ip_to_server')[0][1][0], server)
+
+
+class MultiCreateTest(DriverTestCase, unittest.TestCase):
+    def test_instances_are_found_by_the_batch_name(self):
+        network = self.cloud.add('network', name='proj_network')
+        host = {'name': 'data_node', 'count': 2, 'cloud_vars': []}
+
+        with mock.patch.object(self.driver, 'get_server_args', return_value={'flavor_id': 'flavor-1'}), \
+                mock.patch.object(uuid, 'uuid4', return_value=uuid.UUID('deadbeef' * 4)):
+            created = self.driver.create_vm_group(host, [0, 1], network)
+
+        # one request for both instances
+        self.assertEqual(len(self.cloud.compute.called('_create')), 1)
+        self.assertEqual(sorted(created), ['proj-data_node_1', 'proj-data_node_2'])
+        self.assertEqual(self.cloud.compute.called('servers')[0][2], {'name': '^proj-data_node-deadbeef(-[0-9]+)?$'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import clilib.daemon as daemon
+
+from clilib.ansible_mgr import AnsibleManager
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+class ForwardTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.socket_path = os.path.join(self.tmp_dir, 'daemon.sock')
+
+        server = daemon._UnixServer(self.socket_path, daemon._RequestHandler)
+        server.lusheeta_daemon = daemon.LusheetaDaemon(self.socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+        self.addCleanup(setattr, sys, 'stderr', self.stderr)
+
+    def test_no_daemon(self):
+        self.assertIsNone(daemon.forward({'action': 'ping'}, os.path.join(self.tmp_dir, 'other.sock')))
+
+    def test_ping(self):
+        self.assertEqual(daemon.forward({'action': 'ping'}, self.socket_path), 0)
+
+    def test_invalid_request_error_is_shown(self):
+        return_code = daemon.forward({'action': 'shutdown', 'project': 'p', 'cwd': os.getcwd()}, self.socket_path)
+
+        self.assertEqual(return_code, 2)
+        self.assertIn("Invalid request", sys.stderr.getvalue())
+
+    def test_other_working_directory_falls_back(self):
+        return_code = daemon.forward({'action': 'create', 'project': 'p', 'cwd': self.tmp_dir}, self.socket_path)
+
+        self.assertIsNone(return_code)
+        self.assertIn("The daemon runs in", sys.stderr.getvalue())
+        self.assertIn("running the action in this process", sys.stderr.getvalue())
+
+
+class CommandOutputTest(unittest.TestCase):
+    def test_output_goes_through_sys_stdout(self):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            return_code = AnsibleManager._run_command(['sh', '-c', 'echo ok; echo failed >&2; exit 3'], '.')
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(return_code, 3)
+        self.assertEqual(output, "ok\nfailed\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
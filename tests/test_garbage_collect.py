@@ -0,0 +1,88 @@
+import os
+import time
+import unittest
+
+from clilib.state_journal import StateJournal
+from tests.fake_cloud import DriverTestCase
+
+
+def _timestamp(hours_ago):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - hours_ago * 3600))
+
+
+class GarbageCollectTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        old = _timestamp(5)
+
+        # someone else's resources in the tenant
+        self.cloud.add('server', name='web-01', created_at=old)
+        self.cloud.add('server', name='jenkins-master', created_at=old)
+        self.cloud.add('keypair', name='alice_ssh')
+        self.cloud.add('ip', description='Floating IP for web-01', created_at=old)
+
+        # a failed create: network and security group, no subnet/router/keypair
+        network = self.cloud.add('network', name='failed_network', created_at=old)
+        self.cloud.add('security_group', name='failed_secgroup', created_at=old)
+        self.cloud.add('server', name='failed-a_1', created_at=old)
+        self.cloud.add('keypair', name='failed_ssh')
+        self.cloud.add('port', name='', network_id=network.id, device_owner='compute:nova', created_at=old)
+
+    def names(self):
+        return sorted(r.name for r in self.cloud.resources if r.name)
+
+    def test_projects_are_anchored_by_network_or_security_group(self):
+        projects = self.driver.index_project_resources(self.driver.snapshot_tenant())
+
+        self.assertEqual(sorted(projects), ['failed'])
+        self.assertEqual([r.name for r in projects['failed']['server']], ['failed-a_1'])
+        self.assertEqual([r.name for r in projects['failed']['keypair']], ['failed_ssh'])
+        self.assertEqual(len(projects['failed']['port']), 1)
+
+    def test_reports_only_by_default(self):
+        names = self.names()
+        orphans = self.driver.garbage_collect()
+
+        self.assertEqual(sorted(orphans), ['failed'])
+        self.assertEqual(self.names(), names)
+
+    def test_deletes_the_orphans_only(self):
+        self.driver.garbage_collect(delete=True)
+
+        self.assertEqual(self.names(), ['alice_ssh', 'jenkins-master', 'web-01'])
+
+    def test_resources_without_timestamp_are_never_old(self):
+        self.cloud.add('security_group', name='nodate_secgroup')
+        self.cloud.add('keypair', name='nodate_ssh')
+
+        orphans = self.driver.garbage_collect(delete=True)
+
+        self.assertNotIn('nodate', orphans)
+        self.assertIn('nodate_ssh', self.names())
+
+    def test_recent_projects_are_kept(self):
+        self.cloud.add('network', name='young_network', created_at=_timestamp(0.1))
+
+        self.assertNotIn('young', self.driver.garbage_collect())
+
+    def test_collected_resources_leave_the_state_journal(self):
+        project_path = os.path.join(self.tmp_dir, 'failed')
+        os.makedirs(project_path)
+        journal = StateJournal(project_path)
+        journal.record('network', 'failed_network', self.cloud.find('network', 'failed_network').id)
+        journal.record('keypair', 'failed_ssh', 'failed_ssh')
+        journal.record('subnet', 'failed_network_subnet', 'subnet-gone-already')
+        journal.checkpoint('network')
+
+        self.driver.garbage_collect(delete=True)
+
+        journal = StateJournal(project_path)
+        self.assertEqual(list(journal.resources('network')), [])
+        self.assertEqual(list(journal.resources('keypair')), [])
+        # not deleted by gc, kept for the cleanup of the project
+        self.assertEqual(list(journal.resources('subnet')), ['failed_network_subnet'])
+        self.assertFalse(journal.is_checkpointed('network'))
+
+
+if __name__ == '__main__':
+    unittest.main()
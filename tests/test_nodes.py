@@ -0,0 +1,39 @@
+import unittest
+
+import clilib.utils as utils
+
+from extension.openstack_extension import NodeRecord
+from tests.fake_cloud import DriverTestCase
+
+
+class RegexEscapeTest(unittest.TestCase):
+    def test_only_metacharacters_are_escaped(self):
+        self.assertEqual(utils.regex_escape('my_proj-1'), 'my_proj-1')
+        self.assertEqual(utils.regex_escape('a.b*c(d)'), 'a\\.b\\*c\\(d\\)')
+
+
+class NodesTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.cloud.add('server', name='proj-a_1', status='ACTIVE', addresses={})
+        self.cloud.add('server', name='projx-a_1', status='ACTIVE', addresses={})
+
+    def test_iter_nodes_filters_by_the_unescaped_prefix(self):
+        self.driver._vm_prefix = 'my_proj-x'
+        self.cloud.add('server', name='my_proj-x-a_1', status='ACTIVE', addresses={})
+
+        self.assertEqual([node.name for node in self.driver.iter_nodes()], ['my_proj-x-a_1'])
+        self.assertEqual(self.cloud.compute.called('servers')[0][2], {'name': '^my_proj-x-'})
+
+    def test_journal_nodes(self):
+        self.driver.journal.record('server', 'proj-a_1', 'server-1', status='ACTIVE',
+                                   addresses={'proj_network': []})
+
+        self.assertEqual(self.driver.journal_nodes(),
+                         [NodeRecord(name='proj-a_1', id='server-1', status='ACTIVE',
+                                     addresses={'proj_network': []})])
+        self.assertEqual(self.cloud.compute.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import unittest
+
+import mock
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from clilib.state_journal import StateJournal
+from tests.fake_cloud import CliTestCase, DriverTestCase
+
+
+class LazyConnectionTest(DriverTestCase, unittest.TestCase):
+    def test_connected_at_the_first_api_call(self):
+        self.driver.journal.record('server', 'proj-a', 'server-1', status='ACTIVE', addresses={})
+
+        self.assertEqual([node.name for node in self.driver.journal_nodes()], ['proj-a'])
+        self.assertEqual(self.cassette.connections, 0)
+
+        self.driver.list_nodes()
+        self.driver.list_nodes()
+        self.assertEqual(self.cassette.connections, 1)
+
+
+class OfflineActionsTest(CliTestCase, unittest.TestCase):
+    """The offline actions must not open any connection."""
+
+    def test_prepare_ansible_offline(self):
+        os.makedirs(self.project_path)
+        StateJournal(self.project_path).record('server', 'proj-b', 'server-1', status='ACTIVE', addresses={})
+        StateJournal(self.project_path, StateJournal.file_name_for_region('regionTwo')).record(
+            'server', 'proj-a', 'server-2', status='ACTIVE', addresses={})
+
+        with mock.patch('clilib.cloud_cli.AnsibleManager') as ansible_mgr:
+            self.cli('prepare_ansible', offline=True).prepare_ansible()
+
+        nodes = ansible_mgr.return_value.prepare_files.call_args[0][0]
+        self.assertEqual(sorted(node.name for node in nodes), ['proj-a', 'proj-b'])
+
+    def test_plan(self):
+        with mock.patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.cli('plan').plan()
+
+        lines = stdout.getvalue().splitlines()
+        self.assertTrue([line for line in lines if 'regionTwo' in line and 'proj-a' in line])
+        self.assertTrue([line for line in lines if 'regionOne' in line and 'proj-b' in line])
+        self.assertTrue(lines[-1].startswith("Estimated wall time"))
+
+
+if __name__ == '__main__':
+    unittest.main()
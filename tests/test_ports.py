@@ -0,0 +1,54 @@
+import unittest
+
+import mock
+
+from tests.fake_cloud import DriverTestCase, FakeResource
+
+
+class CreatePortsTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.config['hosts'] = [{'name': 'a', 'count': 5, 'cloud_vars': []}]
+        self.network = self.cloud.add('network', name='proj_network')
+        self.security_groups = [FakeResource(id='sg-default'), None, FakeResource(id='sg-proj')]
+
+        patcher = mock.patch('extension.openstack_extension._PORTS_PER_BULK_REQUEST', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bulk_requests(self):
+        ports = self.driver.create_ports(self.network, self.security_groups)
+
+        bulk_calls = self.cloud.network.called('create_ports')
+        self.assertEqual([len(call[1][0]) for call in bulk_calls], [2, 2, 1])
+        self.assertEqual(bulk_calls[0][1][0][0], {'name': 'proj-a_1_port', 'network_id': self.network.id,
+                                                  'security_group_ids': ['sg-default', 'sg-proj']})
+        self.assertEqual(sorted(ports), ['proj-a_%s' % i for i in range(1, 6)])
+        self.assertEqual(self.driver.journal.get('port', 'proj-a_5')['id'], ports['proj-a_5'].id)
+
+    def test_journaled_ports_are_reused_on_resume(self):
+        for i in [1, 2]:
+            port = self.cloud.add('port', name='proj-a_%s_port' % i, network_id=self.network.id)
+            self.driver.journal.record('port', 'proj-a_%s' % i, port.id)
+        self.driver.journal.record('port', 'proj-a_3', 'port-deleted-meanwhile')
+        self.driver.resume = True
+
+        ports = self.driver.create_ports(self.network, self.security_groups)
+
+        created = [attrs['name'] for call in self.cloud.network.called('create_ports') for attrs in call[1][0]]
+        self.assertEqual(created, ['proj-a_3_port', 'proj-a_4_port', 'proj-a_5_port'])
+        self.assertEqual(len(self.cloud.network.called('ports')), 1)
+        self.assertEqual(len(ports), 5)
+        self.assertNotEqual(self.driver.journal.get('port', 'proj-a_3')['id'], 'port-deleted-meanwhile')
+
+    def test_one_request_per_port_without_the_bulk_call(self):
+        self.cloud.network.missing.add('create_ports')
+
+        ports = self.driver.create_ports(self.network, self.security_groups)
+
+        self.assertEqual(len(self.cloud.network.called('create_port')), 5)
+        self.assertEqual(len(ports), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
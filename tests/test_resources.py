@@ -0,0 +1,52 @@
+import unittest
+
+from openstack.exceptions import NotFoundException
+from tests.fake_cloud import DriverTestCase, FakeResource
+
+
+class ResourceCheckTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.config['vm_management']['default_vm_flavor'] = 'm1.small'
+        self.config['security_group'] = {'rules': [{'direction': 'ingress', 'protocol': 'tcp'}]}
+        self.config['hosts'] = [
+            {'name': 'master', 'count': 1, 'vm_flavor': 'm1.large', 'cloud_vars': [{'assignPublicIP': True}]},
+            {'name': 'agent', 'count': 2, 'cloud_vars': []}
+        ]
+        self.cloud.add('flavor', name='m1.small', vcpus=1, ram=2048)
+        self.cloud.add('flavor', name='m1.large', vcpus=4, ram=8192)
+
+        self.cloud.compute.get_limits = lambda: FakeResource(absolute=FakeResource(
+            instances=10, instances_used=8, total_cores=20, total_cores_used=0, total_ram=-1, total_ram_used=0))
+        self.cloud.network.get_quota = lambda project_id, details: FakeResource(
+            floating_ips={'limit': 5, 'used': 4, 'reserved': 1}, ports={'limit': 100, 'used': 10})
+
+    def test_demand(self):
+        self.assertEqual(self.driver.get_resource_demand(), {
+            'instances': 3, 'cores': 6, 'ram': 12288, 'floating_ips': 1, 'ports': 5, 'networks': 1, 'subnets': 1,
+            'routers': 1, 'security_groups': 1, 'security_group_rules': 1})
+
+    def test_resumed_steps_are_not_demanded(self):
+        for step in ['network', 'security_group', 'server:proj-master', 'floating_ip:proj-master',
+                     'server:proj-agent_1']:
+            self.driver.journal.checkpoint(step)
+        self.driver.resume = True
+
+        demand = self.driver.get_resource_demand()
+
+        self.assertEqual(dict((k, v) for k, v in demand.items() if v), {'instances': 1, 'cores': 1, 'ram': 2048,
+                                                                        'ports': 1})
+
+    def test_shortfalls(self):
+        self.assertEqual(self.driver.check_available_resources(), {'instances': (3, 2), 'floating_ips': (1, 0)})
+
+    def test_skipped_when_the_cloud_has_no_quota_details(self):
+        def get_quota(project_id, details):
+            raise NotFoundException("quota_details extension not found")
+        self.cloud.network.get_quota = get_quota
+
+        self.assertEqual(self.driver.check_available_resources(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
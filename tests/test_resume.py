@@ -0,0 +1,73 @@
+import unittest
+
+import mock
+
+from tests.fake_cloud import DriverTestCase
+
+
+class ResumeTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.driver.resume = True
+        self.journal = self.driver.journal
+
+    def test_verified_steps_are_skipped(self):
+        sg = self.cloud.add('security_group', name='proj_secgroup')
+        self.journal.record('security_group', 'proj_secgroup', sg.id)
+        self.journal.checkpoint('security_group')
+        create = mock.Mock()
+
+        task = self.driver._resumable('security_group', create, verify_fn=self.driver._verify_security_group,
+                                      rollback_fn=self.driver.cleanup_security_group_by_id)
+
+        self.assertEqual(task(), sg)
+        self.assertFalse(create.called)
+        self.assertEqual(self.cloud.of_type('security_group'), [sg])
+
+    def test_step_is_redone_when_its_resources_are_gone(self):
+        # the router was deleted behind our back, the network and subnet are still there
+        network = self.cloud.add('network', name='proj_network')
+        subnet = self.cloud.add('subnet', name='proj_network_subnet')
+        self.journal.record('network', 'proj_network', network.id)
+        self.journal.record('subnet', 'proj_network_subnet', subnet.id)
+        self.journal.record('router', 'proj_network_router', 'router-gone')
+        self.journal.checkpoint('network')
+        create = mock.Mock(return_value='new network')
+
+        task = self.driver._resumable('network', create, verify_fn=self.driver._verify_network,
+                                      rollback_fn=self.driver.cleanup_network_by_id)
+
+        self.assertEqual(task(), 'new network')
+        # the leftovers were rolled back before the step ran again
+        self.assertEqual(self.cloud.resources, [])
+        self.assertEqual(self.journal.resources('network'), {})
+        self.assertTrue(self.journal.is_checkpointed('network'))
+
+    def test_unfinished_server_is_rolled_back(self):
+        # recorded by create_vm, the run died before the VM became ACTIVE
+        server = self.cloud.add('server', name='proj-a', status='BUILD')
+        self.journal.record('server', 'proj-a', server.id)
+        host = {'name': 'a', 'count': 1, 'cloud_vars': []}
+
+        with mock.patch.object(self.driver, 'create_vm', return_value='new server') as create_vm:
+            result = self.driver._vm_task(mock.Mock(), host, 0, 'server:proj-a')()
+
+        self.assertEqual(result, 'new server')
+        self.assertTrue(create_vm.called)
+        self.assertEqual(self.cloud.of_type('server'), [])
+        self.assertIsNone(self.journal.get('server', 'proj-a'))
+        self.assertTrue(self.journal.is_checkpointed('server:proj-a'))
+
+    def test_rollback_waits_for_the_server_until_the_timeout(self):
+        server = self.cloud.add('server', name='proj-a', status='ERROR')
+        self.journal.record('server', 'proj-a', server.id)
+        self.config['vm_management']['hosts_startup_timeout'] = 0
+        # the delete never completes
+        self.cloud.compute.delete_server = lambda *args, **kwargs: None
+
+        self.assertRaises(SystemExit, self.driver._rollback_server, 'proj-a')
+        self.assertEqual(self.journal.get('server', 'proj-a')['id'], server.id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from tests.fake_cloud import DriverTestCase
+
+# what Neutron adds to every new group
+_DEFAULT_EGRESS_RULES = [
+    {'id': 'rule-egress-v4', 'direction': 'egress', 'ethertype': 'IPv4', 'protocol': None, 'port_range_min': None,
+     'port_range_max': None, 'remote_ip_prefix': None, 'remote_group_id': None},
+    {'id': 'rule-egress-v6', 'direction': 'egress', 'ethertype': 'IPv6', 'protocol': None, 'port_range_min': None,
+     'port_range_max': None, 'remote_ip_prefix': None, 'remote_group_id': None}
+]
+
+
+class SecurityGroupRulesTest(DriverTestCase, unittest.TestCase):
+    def setUp(self):
+        DriverTestCase.setUp(self)
+        self.ssh = {'direction': 'ingress', 'protocol': 'tcp', 'port_range_min': 22, 'port_range_max': 22,
+                    'ether_type': 'IPv4'}
+        self.https = {'direction': 'ingress', 'protocol': 'tcp', 'port_range_min': 443, 'port_range_max': 443,
+                      'ether_type': 'IPv4'}
+        self.config['security_group'] = {'rules': [self.ssh, self.https]}
+
+        existing = [
+            # declared
+            {'id': 'rule-ssh', 'direction': 'ingress', 'ethertype': 'IPv4', 'protocol': 'tcp', 'port_range_min': 22,
+             'port_range_max': 22, 'remote_ip_prefix': None, 'remote_group_id': None},
+            # not declared anymore
+            {'id': 'rule-http', 'direction': 'ingress', 'ethertype': 'IPv4', 'protocol': 'tcp',
+             'port_range_min': 80, 'port_range_max': 80, 'remote_ip_prefix': None, 'remote_group_id': None}
+        ] + _DEFAULT_EGRESS_RULES
+        self.sg = self.cloud.add('security_group', name='proj_secgroup', security_group_rules=existing)
+        self.driver.journal.record('security_group', 'proj_secgroup', self.sg.id)
+
+    def test_rule_keys(self):
+        self.assertEqual(self.driver._rule_key(self.ssh), self.driver._rule_key(self.sg.security_group_rules[0]))
+        self.assertEqual(self.driver._rule_key(dict(self.ssh, protocol=6)),
+                         self.driver._rule_key(dict(self.ssh, protocol='6')))
+        self.assertNotEqual(self.driver._rule_key(self.ssh), self.driver._rule_key(self.https))
+
+    def test_neutron_default_rules(self):
+        self.assertTrue(all(self.driver._is_neutron_default_rule(rule) for rule in _DEFAULT_EGRESS_RULES))
+        self.assertFalse(self.driver._is_neutron_default_rule(dict(_DEFAULT_EGRESS_RULES[0], protocol='tcp')))
+        self.assertFalse(self.driver._is_neutron_default_rule(self.ssh))
+
+    def test_only_the_changes_are_sent(self):
+        self.assertEqual(self.driver.apply_security_group_rules(), (1, 1))
+
+        created = self.cloud.network.called('create_security_group_rules')[0][1][0]
+        self.assertEqual(created, [dict(self.https, security_group_id=self.sg.id)])
+        self.assertEqual([call[1] for call in self.cloud.network.called('delete_security_group_rule')],
+                         [('rule-http',)])
+
+    def test_one_request_per_rule_without_the_bulk_call(self):
+        self.cloud.network.missing.add('create_security_group_rules')
+
+        rules = self.driver.create_security_group_rules(self.sg, [self.ssh, self.https])
+
+        self.assertEqual(len(rules), 2)
+        self.assertEqual([call[2] for call in self.cloud.network.called('create_security_group_rule')],
+                         [dict(self.ssh, security_group_id=self.sg.id), dict(self.https, security_group_id=self.sg.id)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from clilib.state_journal import StateJournal
+
+
+class StateJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.journal = StateJournal(self.tmp_dir)
+
+    def test_replays_add_update_remove(self):
+        self.journal.record('server', 'p-a', 'id-a', status='BUILD')
+        self.journal.record('server', 'p-b', 'id-b')
+        self.journal.update('server', 'p-a', status='ACTIVE')
+        self.journal.forget('server', 'p-b')
+
+        self.assertEqual(list(self.journal.resources('server').items()),
+                         [('p-a', {'id': 'id-a', 'data': {'status': 'ACTIVE'}})])
+        # a new instance replays the same state from the file
+        self.assertEqual(StateJournal(self.tmp_dir).get('server', 'p-a'), {'id': 'id-a', 'data': {'status': 'ACTIVE'}})
+
+    def test_resources_is_a_copy(self):
+        self.journal.record('floating_ip', 'p-a', 'fip-a')
+        self.journal.record('floating_ip', 'p-b', 'fip-b')
+        for name in self.journal.resources('floating_ip'):
+            self.journal.forget('floating_ip', name)
+        self.assertEqual(self.journal.resources('floating_ip'), {})
+
+    def test_state_is_kept_in_memory(self):
+        self.journal.record('server', 'p-a', 'id-a')
+        self.journal.get('server', 'p-a')
+
+        replayed = []
+        events = self.journal._events
+        self.journal._events = lambda: replayed.append(True) or events()
+        for i in range(10):
+            self.journal.checkpoint('server:%s' % i)
+            self.assertTrue(self.journal.is_checkpointed('server:%s' % i))
+        self.assertEqual(replayed, [])
+
+    def test_reloads_when_the_file_changes_underneath(self):
+        self.journal.record('server', 'p-a', 'id-a')
+        StateJournal(self.tmp_dir).record('server', 'p-b', 'id-b')
+        self.assertEqual(list(self.journal.resources('server')), ['p-a', 'p-b'])
+
+        os.remove(self.journal.path)
+        self.assertIsNone(self.journal.get('server', 'p-a'))
+
+    def test_torn_last_line_is_skipped(self):
+        self.journal.record('network', 'p_network', 'net-1')
+        with open(self.journal.path, 'a') as journal_stream:
+            journal_stream.write(json.dumps({'op': 'add', 'type': 'subnet'})[:10])
+        self.assertEqual(list(StateJournal(self.tmp_dir).resources('network')), ['p_network'])
+
+    def test_is_empty_ignores_checkpoints(self):
+        self.assertTrue(self.journal.is_empty())
+        self.journal.checkpoint('lookup')
+        self.assertTrue(self.journal.is_empty())
+        self.journal.record('keypair', 'p_ssh', 'p_ssh')
+        self.assertFalse(self.journal.is_empty())
+
+    def test_clear_checkpoints(self):
+        self.journal.checkpoint('lookup')
+        self.journal.checkpoint('network')
+        self.journal.clear_checkpoints()
+        self.assertFalse(self.journal.is_checkpointed('lookup'))
+        self.assertEqual(self.journal.resources('checkpoint'), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
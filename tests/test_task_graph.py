@@ -0,0 +1,98 @@
+import sys
+import threading
+import time
+import traceback
+import unittest
+
+import clilib.telemetry as telemetry
+
+from clilib.task_graph import TaskGraph
+
+
+def _fail_in_worker():
+    raise RuntimeError("boom")
+
+
+class TaskGraphTest(unittest.TestCase):
+    def test_tasks_run_after_their_dependencies(self):
+        order = []
+        lock = threading.Lock()
+
+        def task(name):
+            def run():
+                with lock:
+                    order.append(name)
+                return name.upper()
+            return run
+
+        graph = TaskGraph(max_workers=4)
+        graph.add('network', task('network'))
+        graph.add('keypair', task('keypair'))
+        graph.add('server:a', task('server:a'), deps=['network', 'keypair'])
+        graph.add('floating_ip:a', task('floating_ip:a'), deps=['server:a'])
+        graph.run()
+
+        self.assertEqual(set(order[:2]), set(['network', 'keypair']))
+        self.assertEqual(order[2:], ['server:a', 'floating_ip:a'])
+        self.assertEqual(graph.result('server:a'), 'SERVER:A')
+
+    def test_independent_tasks_run_concurrently(self):
+        graph = TaskGraph(max_workers=4)
+        for i in range(4):
+            graph.add('sleep:%s' % i, lambda: time.sleep(0.2))
+
+        start = time.time()
+        graph.run()
+        self.assertLess(time.time() - start, 0.6)
+
+    def test_failure_stops_new_tasks_and_keeps_the_traceback(self):
+        started = []
+        graph = TaskGraph(max_workers=1)
+        graph.add('fail', _fail_in_worker)
+        graph.add('after', lambda: started.append('after'), deps=['fail'])
+
+        try:
+            graph.run()
+            self.fail("the error of the task wasn't raised")
+        except RuntimeError:
+            frames = [frame[2] for frame in traceback.extract_tb(sys.exc_info()[2])]
+        self.assertIn('_fail_in_worker', frames)
+        self.assertEqual(started, [])
+
+    def test_system_exit_of_a_task_is_raised(self):
+        graph = TaskGraph()
+        graph.add('quit', lambda: exit(1))
+        self.assertRaises(SystemExit, graph.run)
+
+    def test_unknown_dependency(self):
+        graph = TaskGraph()
+        graph.add('server:a', lambda: None, deps=['network'])
+        self.assertRaises(ValueError, graph.run)
+
+    def test_dependency_cycle(self):
+        graph = TaskGraph()
+        graph.add('a', lambda: None, deps=['b'])
+        graph.add('b', lambda: None, deps=['a'])
+        self.assertRaises(ValueError, graph.run)
+
+    def test_log_context_is_carried_into_the_workers(self):
+        graph = TaskGraph()
+        graph.add('context', lambda: telemetry.get_context().get('host'))
+        with telemetry.log_context(host='proj-a'):
+            graph.run()
+        self.assertEqual(graph.result('context'), 'proj-a')
+
+    def test_simulate(self):
+        graph = TaskGraph(max_workers=2)
+        graph.add('lookup', None)
+        graph.add('server:a', None, deps=['lookup'])
+        graph.add('server:b', None, deps=['lookup'])
+        graph.add('server:c', None, deps=['lookup'])
+        durations = {'lookup': 1.0, 'server:a': 10.0, 'server:b': 10.0, 'server:c': 10.0}
+
+        # two workers: a and b in parallel, then c
+        self.assertEqual(graph.simulate(durations), 21.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
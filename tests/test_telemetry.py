@@ -0,0 +1,138 @@
+import json
+import logging
+import unittest
+
+import clilib.telemetry as telemetry
+
+from clilib.task_graph import TaskGraph
+from clilib.telemetry import InstrumentedApi, JsonLinesFormatter, MetricsRegistry
+
+
+class _Api(object):
+    def get_server(self, server_id):
+        return server_id
+
+    def servers(self):
+        for name in ['a', 'b']:
+            yield name
+
+    def delete_server(self, server_id):
+        raise RuntimeError("gone")
+
+
+class MetricsRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counters(self):
+        self.registry.inc('floating_ips_total', op='create')
+        self.registry.inc('floating_ips_total', value=2, help_text="Floating ip operations", op='create')
+        self.registry.inc('floating_ips_total', op='delete')
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('# HELP lusheeta_floating_ips_total Floating ip operations', lines)
+        self.assertIn('# TYPE lusheeta_floating_ips_total counter', lines)
+        self.assertIn('lusheeta_floating_ips_total{op="create"} 3', lines)
+        self.assertIn('lusheeta_floating_ips_total{op="delete"} 1', lines)
+
+    def test_histograms(self):
+        self.registry.observe('vm_boot_seconds', 20, host_group='agent')
+        self.registry.observe('vm_boot_seconds', 40, host_group='agent')
+
+        histograms = self.registry.histograms()
+        self.assertEqual(histograms, {('vm_boot_seconds', (('host_group', 'agent'),)): (60.0, 2)})
+        # the keys are hashable, they can be looked up and merged
+        self.assertEqual(len(set(histograms)), 1)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('lusheeta_vm_boot_seconds_bucket{host_group="agent",le="10.0"} 0', lines)
+        self.assertIn('lusheeta_vm_boot_seconds_bucket{host_group="agent",le="30.0"} 1', lines)
+        self.assertIn('lusheeta_vm_boot_seconds_bucket{host_group="agent",le="+Inf"} 2', lines)
+        self.assertIn('lusheeta_vm_boot_seconds_sum{host_group="agent"} 60.0', lines)
+        self.assertIn('lusheeta_vm_boot_seconds_count{host_group="agent"} 2', lines)
+
+    def test_timer_observes_when_the_block_raises(self):
+        try:
+            with self.registry.timer('action_seconds', action='create'):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.registry.histograms()[('action_seconds', (('action', 'create'),))][1], 1)
+
+    def test_const_labels_and_escaping(self):
+        self.registry.const_labels = {'project': 'p'}
+        self.registry.inc('errors_total', reason='say "hi"')
+        self.assertIn('lusheeta_errors_total{project="p",reason="say \\"hi\\""} 1', self.registry.render())
+
+
+class MetricsScopeTest(unittest.TestCase):
+    def test_scoped_registry(self):
+        registry = MetricsRegistry()
+        with telemetry.metrics_scope(registry):
+            telemetry.metrics.inc('scoped_total')
+            telemetry.metrics.const_labels = {'project': 'p'}
+        telemetry.metrics.inc('unscoped_total')
+
+        self.assertEqual(registry.render().splitlines()[-1], 'lusheeta_scoped_total{project="p"} 1')
+        self.assertNotIn('unscoped_total', registry.render())
+        process_metrics = telemetry.current_metrics().render()
+        self.assertIn('lusheeta_unscoped_total 1', process_metrics)
+        self.assertNotIn('project="p"', process_metrics)
+
+    def test_scope_is_carried_into_the_workers(self):
+        registry = MetricsRegistry()
+        graph = TaskGraph()
+        graph.add('observe', lambda: telemetry.metrics.observe('vm_boot_seconds', 1.0))
+        with telemetry.metrics_scope(registry):
+            graph.run()
+
+        self.assertEqual(list(registry.histograms().values()), [(1.0, 1)])
+
+    def test_instrumented_api_uses_the_scope(self):
+        registry = MetricsRegistry()
+        api = InstrumentedApi(_Api(), 'compute')
+        with telemetry.metrics_scope(registry):
+            api.get_server('id-1')
+
+        self.assertIn(('api_call_seconds', (('api', 'compute'), ('call', 'get_server'))), registry.histograms())
+
+
+class InstrumentedApiTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.api = InstrumentedApi(_Api(), 'compute', self.registry)
+
+    def count(self, call):
+        return self.registry.histograms()[('api_call_seconds', (('api', 'compute'), ('call', call)))][1]
+
+    def test_calls_are_measured(self):
+        self.assertEqual(self.api.get_server('id-1'), 'id-1')
+        self.assertEqual(self.count('get_server'), 1)
+
+    def test_listings_are_measured_when_exhausted(self):
+        listing = self.api.servers()
+        self.assertNotIn(('api_call_seconds', (('api', 'compute'), ('call', 'servers'))),
+                         self.registry.histograms())
+        self.assertEqual(list(listing), ['a', 'b'])
+        self.assertEqual(self.count('servers'), 1)
+
+    def test_errors_are_counted(self):
+        self.assertRaises(RuntimeError, self.api.delete_server, 'id-1')
+        self.assertEqual(self.count('delete_server'), 1)
+        self.assertIn('lusheeta_api_call_errors_total{api="compute",call="delete_server"} 1', self.registry.render())
+
+
+class JsonLinesFormatterTest(unittest.TestCase):
+    def test_context_fields(self):
+        record = logging.LogRecord('lusheeta', logging.INFO, __file__, 1, "Creating VM: %s", ('p-a',), None)
+        with telemetry.log_context(host='p-a'):
+            telemetry.ContextFilter().filter(record)
+
+        line = json.loads(JsonLinesFormatter().format(record))
+        self.assertEqual(line['message'], "Creating VM: p-a")
+        self.assertEqual(line['host'], 'p-a')
+        self.assertEqual(line['level'], 'INFO')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import threading
+import unittest
+
+import clilib.telemetry as telemetry
+
+from clilib.telemetry import MetricsRegistry
+from clilib.timings import TimingHistory
+
+
+class TimingHistoryTest(unittest.TestCase):
+    def test_merge_histograms(self):
+        registry = MetricsRegistry()
+        registry.observe('vm_boot_seconds', 20, host_group='agent')
+        registry.observe('vm_boot_seconds', 40, host_group='agent')
+        history = TimingHistory({'vm_boot_seconds{host_group=agent}': {'sum': 30.0, 'count': 1}})
+
+        history.merge_histograms(registry.histograms())
+
+        self.assertEqual(history.mean('vm_boot_seconds', host_group='agent'), 30.0)
+        self.assertEqual(history.samples(), 3)
+
+    def test_concurrent_actions_keep_their_timings_apart(self):
+        # the daemon runs the actions of two projects at the same time, each in the scope of its own registry
+        registries = {'a': MetricsRegistry(), 'b': MetricsRegistry()}
+
+        def action(project, duration):
+            with telemetry.metrics_scope(registries[project]):
+                telemetry.metrics.observe('vm_boot_seconds', duration, host_group='agent')
+
+        threads = [threading.Thread(target=action, args=('a', 10)), threading.Thread(target=action, args=('b', 50))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for project, duration in [('a', 10.0), ('b', 50.0)]:
+            history = TimingHistory()
+            history.merge_histograms(registries[project].histograms())
+            self.assertEqual(history.mean('vm_boot_seconds', host_group='agent'), duration)
+            self.assertEqual(history.samples(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()